@@ -141,17 +141,48 @@ class Sentence():
             self.cells.discard(cell)
 
 
+class InferenceStats():
+    """
+    Counters describing the inference work done by a MinesweeperAI.
+    Totals accumulate over the whole game, while `cells_resolved`
+    only refers to the most recent call to add_knowledge.
+    """
+
+    def __init__(self):
+        self.moves = 0
+        self.sentences_added = 0
+        self.subset_attempts = 0
+        self.subset_successes = 0
+        self.fixpoint_iterations = 0
+        self.cells_resolved = 0
+        self.cells_resolved_total = 0
+
+    def as_dict(self):
+        """
+        Returns a snapshot of every counter, keyed by name.
+        """
+        return dict(vars(self))
+
+    def __str__(self):
+        return ", ".join(f"{key}={value}" for key, value in vars(self).items())
+
+
 class MinesweeperAI():
     """
     Minesweeper game player
     """
 
-    def __init__(self, height=8, width=8):
+    def __init__(self, height=8, width=8, on_move=None):
 
         # Set initial height and width
         self.height = height
         self.width = width
 
+        # Inference counters, and an optional callback that receives them
+        # after every call to add_knowledge (silent when None)
+        self.stats = InferenceStats()
+        self.on_move = on_move
+
         # Keep track of which cells have been clicked on
         self.moves_made = set()
 
@@ -185,6 +216,10 @@ class MinesweeperAI():
         Called when the Minesweeper board tells us, for a given
         safe cell, how many neighboring cells have mines in them.
         """
+        stats = self.stats
+        stats.moves += 1
+        resolved_before = len(self.safes) + len(self.mines)
+
         self.moves_made.add(cell)
         self.mark_safe(cell)
 
@@ -200,6 +235,7 @@ class MinesweeperAI():
         new_sentence = Sentence(cells, count)
         if new_sentence not in self.knowledge and count > 0:
             self.knowledge.append(new_sentence)
+            stats.sentences_added += 1
         
         # mark any additional cells as safe or as mines from new Sentence
         if new_sentence.known_mines() is not None:
@@ -222,9 +258,12 @@ class MinesweeperAI():
                 if sentence1 == sentence2:
                     continue
                 # make new knowledge based on sentence subsets
+                stats.subset_attempts += 1
                 if sentence1.cells.issubset(sentence2.cells):
                     sentence3 = Sentence(sentence2.cells.difference(sentence1.cells), sentence2.count - sentence1.count)
                     self.knowledge.append(sentence3)
+                    stats.subset_successes += 1
+                    stats.sentences_added += 1
                     if sentence3.known_mines() is not None:
                         for mine in sentence3.known_mines().copy():
                             self.mark_mine(mine)
@@ -234,6 +273,7 @@ class MinesweeperAI():
 
         # loop until no changes
         while True:
+            stats.fixpoint_iterations += 1
             changes = False
             # add new mines and safes from self to knowledge
             for sentence in self.knowledge:
@@ -258,13 +298,11 @@ class MinesweeperAI():
             if changes == False:
                 break
 
-        print(".............................")
-        for sentence in self.knowledge:
-            print(sentence)
-        print(" ")
-        print("SAFES", self.safes)
-        print("MINES", self.mines)
-
+        # record how many cells this move resolved and report if asked to
+        stats.cells_resolved = len(self.safes) + len(self.mines) - resolved_before
+        stats.cells_resolved_total += stats.cells_resolved
+        if self.on_move is not None:
+            self.on_move(stats)
 
     def make_safe_move(self):
         """
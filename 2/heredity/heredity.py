@@ -1,7 +1,15 @@
+import contextlib
 import csv
+import functools
+import heapq
 import itertools
+import json
+import multiprocessing
+import numpy
+import os
+import re
 import sys
-import copy
+import time
 
 PROBS = {
 
@@ -37,53 +45,57 @@ PROBS = {
     "mutation": 0.01
 }
 
+# Number of gene assignments enumerated at a time
+CHUNK = 100000
 
-def main():
+# Defaults for approximate inference: total samples, parallel chains,
+# and Gibbs sweeps discarded before sampling
+SAMPLES = 100000
+CHAINS = 1000
+BURN_IN = 100
 
-    # Check for proper usage
-    if len(sys.argv) != 2:
-        sys.exit("Usage: python heredity.py data.csv")
-    people = load_data(sys.argv[1])
+METHODS = ["exact", "enumerate", "weighting", "gibbs"]
 
-    # Keep track of gene and trait probabilities for each person
-    probabilities = {
-        person: {
-            "gene": {
-                2: 0,
-                1: 0,
-                0: 0
-            },
-            "trait": {
-                True: 0,
-                False: 0
-            }
-        }
-        for person in people
-    }
+# Families handed to each batch worker at a time
+BATCH_CHUNK = 16
 
-    # Loop over all sets of people who might have the trait
-    names = set(people)
-    for have_trait in powerset(names):
+# Compiled networks of a process, by pedigree shape
+networks = {}
 
-        # Check if current set of people violates known information
-        fails_evidence = any(
-            (people[person]["trait"] is not None and
-             people[person]["trait"] != (person in have_trait))
-            for person in names
-        )
-        if fails_evidence:
-            continue
 
-        # Loop over all sets of people who might have the gene
-        for one_gene in powerset(names):
-            for two_genes in powerset(names - one_gene):
-
-                # Update probabilities with new joint probability
-                p = joint_probability(people, one_gene, two_genes, have_trait)
-                update(probabilities, one_gene, two_genes, have_trait, p)
+def main():
 
-    # Ensure probabilities sum to 1
-    normalize(probabilities)
+    # Batch mode over many families
+    if len(sys.argv) in [3, 4] and sys.argv[1] == "--batch":
+        return main_batch(*sys.argv[2:])
+
+    # Check for proper usage; sampling runs for a number of samples, or
+    # for a time budget ending in "s"
+    budget = re.fullmatch(r"(\d+)(s?)", sys.argv[3]) if len(sys.argv) == 4 else None
+    if (len(sys.argv) not in [2, 3, 4] or
+            (len(sys.argv) >= 3 and sys.argv[2] not in METHODS) or
+            (len(sys.argv) == 4 and not (budget and int(budget.group(1)) > 0))):
+        sys.exit("Usage: python heredity.py data.csv [exact|enumerate|weighting|gibbs] [samples|<seconds>s]\n"
+                 "       python heredity.py --batch directory|- [output.jsonl]")
+    people = load_data(sys.argv[1])
+    method = sys.argv[2] if len(sys.argv) >= 3 else "exact"
+
+    samples, seconds = SAMPLES, None
+    if budget and budget.group(2):
+        samples, seconds = None, int(budget.group(1))
+    elif budget:
+        samples = int(budget.group(1))
+
+    # Compute gene and trait probabilities for each person
+    diagnostics = None
+    if method == "exact":
+        probabilities = infer(compile_network(people), people)
+    elif method == "enumerate":
+        probabilities = enumerate_probabilities(people)
+    elif method == "weighting":
+        probabilities, diagnostics = likelihood_weighting(people, samples, seconds)
+    else:
+        probabilities, diagnostics = gibbs_sampling(people, samples, seconds)
 
     # Print results
     for person in people:
@@ -93,6 +105,104 @@ def main():
             for value in probabilities[person][field]:
                 p = probabilities[person][field][value]
                 print(f"    {value}: {p:.4f}")
+    if diagnostics is not None:
+        for field, value in diagnostics.items():
+            print(f"{field}: {value}" if isinstance(value, int) else f"{field}: {value:.4f}")
+
+
+def main_batch(source, output=None):
+    """
+    Compute exact probabilities for every family CSV in the directory
+    `source`, or for every file named on standard input if `source` is
+    "-", using a pool of worker processes. Write one JSON line per family
+    to `output` (standard output by default) and report the throughput.
+    """
+    if source == "-":
+        paths = (line.strip() for line in sys.stdin if line.strip())
+    else:
+        paths = (
+            os.path.join(source, filename) for filename in sorted(os.listdir(source))
+            if filename.endswith(".csv")
+        )
+
+    count = 0
+    start = time.perf_counter()
+    with open(output, "w") if output else contextlib.nullcontext(sys.stdout) as f:
+        with multiprocessing.Pool() as pool:
+            for path, probabilities in pool.imap(batch_family, paths, chunksize=BATCH_CHUNK):
+                f.write(json.dumps({"family": path, "probabilities": probabilities}) + "\n")
+                count += 1
+    elapsed = time.perf_counter() - start
+    print(f"Processed {count} families in {elapsed:.2f}s ({count / elapsed:.1f} families per second)", file=sys.stderr)
+
+
+def batch_family(path):
+    """
+    Return a tuple (path, probabilities) with the exact probabilities of
+    the family in the CSV at `path`, compiling its network only if no
+    family of the same shape was seen before by this process.
+    """
+    people = load_data(path)
+    shape = pedigree_shape(people)
+    if shape not in networks:
+        networks[shape] = compile_network(people)
+    return path, infer(networks[shape], people)
+
+
+def enumerate_probabilities(people):
+    """
+    Compute gene and trait probabilities for each person by enumerating
+    every joint assignment of genes, in chunks of integer arrays.
+
+    Unknown traits are summed out of each assignment rather than
+    enumerated, which gives the same result as enumerating them.
+    """
+    prior, inheritance, trait = probability_tables()
+    names = list(people)
+    index = {name: i for i, name in enumerate(names)}
+
+    genes_total = numpy.zeros((len(names), 3))
+    trait_total = numpy.zeros(len(names))
+    for genes in gene_assignments(len(names)):
+
+        # joint probability of every assignment in the chunk
+        p = numpy.ones(len(genes))
+        for i, name in enumerate(names):
+            mother, father = people[name]["mother"], people[name]["father"]
+            if mother and father:
+                p *= inheritance[genes[:, index[mother]], genes[:, index[father]], genes[:, i]]
+            else:
+                p *= prior[genes[:, i]]
+            if people[name]["trait"] is not None:
+                p *= trait[genes[:, i], int(people[name]["trait"])]
+
+        # add it to each person's gene and trait distributions
+        for i in range(len(names)):
+            genes_total[i] += numpy.bincount(genes[:, i], weights=p, minlength=3)
+        trait_total += p @ trait[genes, 1]
+
+    # Ensure probabilities sum to 1
+    total = genes_total[0].sum()
+    probabilities = {}
+    for i, name in enumerate(names):
+        has_trait = trait_total[i] / total if people[name]["trait"] is None else float(people[name]["trait"])
+        probabilities[name] = {
+            "gene": {g: float(genes_total[i, g] / total) for g in [2, 1, 0]},
+            "trait": {True: float(has_trait), False: float(1 - has_trait)}
+        }
+    return probabilities
+
+
+def gene_assignments(n, chunk=CHUNK):
+    """
+    Yield every assignment of 0, 1 or 2 genes to `n` people, as integer
+    arrays with one row per assignment and one column per person, at
+    most `chunk` rows at a time.
+    """
+    powers = 3 ** numpy.arange(n)
+    for start in range(0, 3 ** n, chunk):
+        codes = numpy.arange(start, min(start + chunk, 3 ** n))
+        yield codes[:, None] // powers % 3
 
 
 def load_data(filename):
@@ -119,14 +229,13 @@ def load_data(filename):
 
 def powerset(s):
     """
-    Return a list of all possible subsets of set s.
+    Yield all possible subsets of set s.
     """
     s = list(s)
-    return [
-        set(s) for s in itertools.chain.from_iterable(
-            itertools.combinations(s, r) for r in range(len(s) + 1)
-        )
-    ]
+    for subset in itertools.chain.from_iterable(
+        itertools.combinations(s, r) for r in range(len(s) + 1)
+    ):
+        yield set(subset)
 
 
 def joint_probability(people, one_gene, two_genes, have_trait):
@@ -140,48 +249,26 @@ def joint_probability(people, one_gene, two_genes, have_trait):
         * everyone in set `have_trait` has the trait, and
         * everyone not in set` have_trait` does not have the trait.
     """
-    case = people.copy()
+    prior, inheritance, trait = probability_tables()
 
     # how many genes
-    for person in case:
-        if person in two_genes:
-            case[person]['genes'] = 2
-        elif person in one_gene:
-            case[person]['genes'] = 1
-        else:
-            case[person]['genes'] = 0
+    genes = {
+        person: 2 if person in two_genes else 1 if person in one_gene else 0
+        for person in people
+    }
 
-    # probability for each case
+    # probability for each case, looked up in the precomputed tables
     joint = 1
-    for person in case:
-        p = 0
-        genes = case[person]['genes']
-        
-        # P(n genes)
-        father = case[person]['father']
-        mother = case[person]['mother']
+    for person in people:
+        father = people[person]['father']
+        mother = people[person]['mother']
         if mother and father:
-            p_mother = (case[mother]['genes'] / 2) - ((case[mother]['genes'] - 1) * PROBS["mutation"])
-            p_father = (case[father]['genes'] / 2) - ((case[father]['genes'] - 1) * PROBS["mutation"])
-            if genes == 2:   # P(m^f)
-                p = p_mother * p_father
-            if genes == 1:   # P(m^-f) + P(f^-m)
-                p = (p_mother * (1 - p_father)) + (p_father * (1 - p_mother))
-            if genes == 0:   # P(-m^-f)
-                p = (1 - p_mother) * (1 - p_father)
+            p = inheritance[genes[mother], genes[father], genes[person]]
         else:
-            p = PROBS['gene'][genes]
+            p = prior[genes[person]]
+        joint *= p * trait[genes[person], int(person in have_trait)]
 
-        # P(trait or no trait)
-        if person in have_trait:
-            p *= PROBS['trait'][genes][True]
-        else:
-            p *= PROBS['trait'][genes][False]
-        
-        # multiply with previous P(case)
-        joint *= p
-    
-    return joint
+    return float(joint)
 
 
 def update(probabilities, one_gene, two_genes, have_trait, p):
@@ -222,5 +309,425 @@ def normalize(probabilities):
         probabilities[person]['trait'][False] *= 1 / trait_sum
         
 
+@functools.cache
+def probability_tables():
+    """
+    Return a tuple (prior, inheritance, trait) of arrays built from PROBS:
+    prior[g] is the probability of g copies of the gene for a person
+    with no parents listed, inheritance[m, f, g] the probability of g
+    copies given m and f copies in the mother and father, and
+    trait[g, t] the probability of having the trait (t = 1) or not
+    (t = 0) given g copies of the gene.
+    """
+    prior = numpy.array([PROBS["gene"][g] for g in range(3)])
+    trait = numpy.array([[PROBS["trait"][g][False], PROBS["trait"][g][True]] for g in range(3)])
+
+    # probability of passing the gene on, given copies in the parent
+    passes = numpy.array([g / 2 - (g - 1) * PROBS["mutation"] for g in range(3)])
+    m, f = numpy.meshgrid(passes, passes, indexing="ij")
+    inheritance = numpy.stack([
+        (1 - m) * (1 - f),
+        m * (1 - f) + f * (1 - m),
+        m * f
+    ], axis=-1)
+
+    return prior, inheritance, trait
+
+
+def compile_network(people):
+    """
+    Compile the family in `people` into a junction tree for exact
+    inference, independent of the trait evidence.
+
+    Every person is a gene variable, with a factor over their own genes
+    or over their mother's, father's and own genes. Variables are
+    eliminated in min-fill order, and each elimination creates a clique
+    of the variable and its neighbors, attached to the clique of the
+    first of those neighbors to be eliminated.
+
+    The network only depends on the shape of the family tree, so it can
+    be reused for any family with the same pedigree_shape. Return a
+    dictionary with the elimination `order` (as positions of people in
+    `people`), and for every variable the `scope` of its clique (starting
+    with the variable itself), its `parent` clique (or None), its
+    `children` cliques and the gene factors `assigned` to it.
+    """
+    names = list(people)
+    index = {name: i for i, name in enumerate(names)}
+    factors = []
+    for name in names:
+        mother, father = people[name]["mother"], people[name]["father"]
+        if mother and father:
+            factors.append((index[mother], index[father], index[name]))
+        else:
+            factors.append((index[name],))
+
+    # moralized graph: variables sharing a factor are neighbors
+    graph = [set() for name in names]
+    for scope in factors:
+        for v in scope:
+            graph[v].update(u for u in scope if u != v)
+
+    # eliminate variables greedily, adding as few fill-in edges as possible
+    # (costs are kept in a heap and refreshed around each eliminated variable)
+    order = []
+    scopes = [None] * len(names)
+    costs = {v: (fill_in(graph, v), len(graph[v])) for v in range(len(names))}
+    heap = [(cost, v) for v, cost in costs.items()]
+    heapq.heapify(heap)
+    while heap:
+        cost, v = heapq.heappop(heap)
+        if scopes[v] is not None or costs[v] != cost:
+            continue
+        scopes[v] = (v,) + tuple(sorted(graph[v]))
+        for u in graph[v]:
+            graph[u].update(graph[v] - {u})
+            graph[u].discard(v)
+        order.append(v)
+        affected = set(graph[v]).union(*(graph[u] for u in graph[v])) - {v}
+        for u in affected:
+            costs[u] = (fill_in(graph, u), len(graph[u]))
+            heapq.heappush(heap, (costs[u], u))
+
+    # attach every clique to the clique of the first variable it keeps
+    position = {v: i for i, v in enumerate(order)}
+    parent = [min(scopes[v][1:], key=position.get) if len(scopes[v]) > 1 else None for v in range(len(names))]
+    children = [[] for name in names]
+    for v in order:
+        if parent[v] is not None:
+            children[parent[v]].append(v)
+
+    # each factor goes to the clique of its first eliminated variable
+    assigned = [[] for name in names]
+    for person, scope in enumerate(factors):
+        assigned[min(scope, key=position.get)].append((person, scope))
+
+    return {
+        "order": order,
+        "scope": scopes,
+        "parent": parent,
+        "children": children,
+        "assigned": assigned
+    }
+
+
+def pedigree_shape(people):
+    """
+    Return a hashable description of the family tree in `people`: for
+    each person, in order, the positions of their mother and father,
+    or None if their parents are not listed.
+    """
+    index = {name: i for i, name in enumerate(people)}
+    return tuple(
+        (index[person["mother"]], index[person["father"]])
+        if person["mother"] and person["father"] else None
+        for person in people.values()
+    )
+
+
+def fill_in(graph, v):
+    """
+    Return the number of edges that eliminating `v` would add to `graph`.
+    """
+    neighbors = list(graph[v])
+    return sum(
+        1 for i, u in enumerate(neighbors) for w in neighbors[i + 1:]
+        if w not in graph[u]
+    )
+
+
+def infer(network, people):
+    """
+    Compute gene and trait probabilities for each person in `people`,
+    given their known traits, by passing messages up and down the
+    junction tree `network` built by compile_network for a family of
+    the same pedigree_shape.
+    """
+    prior, inheritance, trait = probability_tables()
+    names = list(people)
+    order, scopes = network["order"], network["scope"]
+    parent, children = network["parent"], network["children"]
+
+    # clique potentials: assigned gene factors times trait evidence
+    potentials = []
+    for v, name in enumerate(names):
+        factors = [
+            (scope, inheritance if len(scope) == 3 else prior)
+            for person, scope in network["assigned"][v]
+        ]
+        if people[name]["trait"] is not None:
+            factors.append(((v,), trait[:, int(people[name]["trait"])]))
+        potentials.append(contract(factors, scopes[v]))
+
+    # upward pass, from the first eliminated clique to the roots
+    up = [None] * len(names)
+    for v in order:
+        if parent[v] is not None:
+            incoming = [(scopes[c][1:], up[c]) for c in children[v]]
+            up[v] = normalized(contract([(scopes[v], potentials[v])] + incoming, scopes[v][1:]))
+
+    # downward pass, from the roots back, leaving beliefs in every clique
+    down = [None] * len(names)
+    probabilities = {}
+    for v in reversed(order):
+        incoming = [(scopes[c][1:], up[c]) for c in children[v]]
+        if parent[v] is not None:
+            incoming.append((scopes[v][1:], down[v]))
+        for c in children[v]:
+            others = [message for message, child in zip(incoming, children[v] + [None]) if child != c]
+            down[c] = normalized(contract([(scopes[v], potentials[v])] + others, scopes[c][1:]))
+
+        genes = normalized(contract([(scopes[v], potentials[v])] + incoming, (v,)))
+        has_trait = genes @ trait[:, 1] if people[names[v]]["trait"] is None else float(people[names[v]]["trait"])
+        probabilities[names[v]] = {
+            "gene": {g: float(genes[g]) for g in [2, 1, 0]},
+            "trait": {True: float(has_trait), False: float(1 - has_trait)}
+        }
+
+    return {name: probabilities[name] for name in names}
+
+
+def contract(factors, scope):
+    """
+    Multiply `factors`, given as (variables, table) pairs, and sum out
+    every variable not in `scope`. Return a table over `scope`.
+    """
+    labels = {}
+    operands = []
+    for variables, table in factors:
+        operands += [table, [labels.setdefault(v, len(labels)) for v in variables]]
+    for v in scope:
+        if v not in labels:
+            operands += [numpy.ones(3), [labels.setdefault(v, len(labels))]]
+    return numpy.einsum(*operands, [labels[v] for v in scope])
+
+
+def normalized(table):
+    """
+    Return `table` scaled to sum to 1.
+    """
+    return table / table.sum()
+
+
+def topological_order(people):
+    """
+    Return the names in `people` ordered so that parents come before
+    their children.
+    """
+    order = []
+    placed = set()
+
+    def place(name):
+        if name in placed:
+            return
+        placed.add(name)
+        for parent in [people[name]["mother"], people[name]["father"]]:
+            if parent:
+                place(parent)
+        order.append(name)
+
+    for name in people:
+        place(name)
+    return order
+
+
+def sampling_budget(samples, seconds, start):
+    """
+    Return whether sampling should go on, having drawn `samples` more
+    than required so far (negative while still short), or, if `seconds`
+    is given, until that many seconds have passed since `start`.
+    """
+    if seconds is not None:
+        return time.perf_counter() - start < seconds
+    return samples < 0
+
+
+def likelihood_weighting(people, samples=SAMPLES, seconds=None, chains=CHAINS, rng=None):
+    """
+    Approximate gene and trait probabilities for each person by
+    likelihood weighting: genes are sampled forward from the parents,
+    in batches of `chains` at a time, and every sample is weighted by
+    the probability of the known traits.
+
+    Sampling stops after `samples` samples or, if `seconds` is given,
+    after that many seconds, but at least one batch is always drawn so
+    that there is something to estimate from. Return a tuple
+    (probabilities, diagnostics), where diagnostics hold the number of
+    samples, their effective sample size and the largest standard error
+    of any reported probability.
+
+    Weights are kept as logarithms, since the product of many trait
+    probabilities underflows in large pedigrees. Totals are kept relative
+    to the largest log-weight seen so far, and rescaled when it grows.
+    """
+    prior, inheritance, trait = probability_tables()
+    rng = numpy.random.default_rng() if rng is None else rng
+    names = topological_order(people)
+    index = {name: i for i, name in enumerate(names)}
+
+    genes_total = numpy.zeros((len(names), 3))
+    trait_total = numpy.zeros(len(names))
+    weights_sum = weights_squared = 0
+    scale = -numpy.inf
+    log_trait = numpy.log(trait)
+    drawn = 0
+    start = time.perf_counter()
+    while drawn == 0 or sampling_budget(drawn - (samples or 0), seconds, start):
+        genes = numpy.zeros((chains, len(names)), dtype=numpy.int64)
+        log_weights = numpy.zeros(chains)
+        for i, name in enumerate(names):
+            mother, father = people[name]["mother"], people[name]["father"]
+            if mother and father:
+                distribution = inheritance[genes[:, index[mother]], genes[:, index[father]]]
+            else:
+                distribution = prior
+            genes[:, i] = sample_genes(distribution, rng, chains)
+            if people[name]["trait"] is not None:
+                log_weights += log_trait[genes[:, i], int(people[name]["trait"])]
+
+        # rescale the totals if this batch has the largest weight so far
+        largest = max(scale, log_weights.max())
+        if largest > scale:
+            factor = numpy.exp(scale - largest)
+            genes_total *= factor
+            trait_total *= factor
+            weights_sum *= factor
+            weights_squared *= factor ** 2
+            scale = largest
+        weights = numpy.exp(log_weights - scale)
+
+        for i in range(len(names)):
+            genes_total[i] += numpy.bincount(genes[:, i], weights=weights, minlength=3)
+        trait_total += weights @ trait[genes, 1]
+        weights_sum += weights.sum()
+        weights_squared += (weights ** 2).sum()
+        drawn += chains
+
+    # standard error of a weighted mean, from the effective sample size
+    effective = weights_sum ** 2 / weights_squared
+    genes_p = genes_total / weights_sum
+    trait_p = trait_total / weights_sum
+    error = numpy.sqrt(max((genes_p * (1 - genes_p)).max(), (trait_p * (1 - trait_p)).max()) / effective)
+    diagnostics = {
+        "Samples": drawn,
+        "Effective sample size": float(effective),
+        "Max standard error": float(error)
+    }
+    return sampled_probabilities(people, names, genes_p, trait_p), diagnostics
+
+
+def gibbs_sampling(people, samples=SAMPLES, seconds=None, chains=CHAINS, burn_in=BURN_IN, rng=None):
+    """
+    Approximate gene and trait probabilities for each person by Gibbs
+    sampling: `chains` independent chains resample every person's genes
+    in turn from their distribution given everyone else's, and the first
+    `burn_in` sweeps are discarded. Each sweep adds the conditional
+    distributions (rather than the sampled genes) to the estimates.
+
+    Sampling stops after `samples` samples (sweeps times chains) or, if
+    `seconds` is given, after that many seconds, but at least one sweep
+    past the burn-in is always kept. Return a tuple
+    (probabilities, diagnostics), where diagnostics hold the number of
+    samples, the largest Gelman-Rubin R-hat of any gene probability
+    (close to 1 once the chains agree) and the largest standard error
+    of any gene probability, estimated across chains.
+    """
+    prior, inheritance, trait = probability_tables()
+    rng = numpy.random.default_rng() if rng is None else rng
+    names = topological_order(people)
+    index = {name: i for i, name in enumerate(names)}
+    parents = [
+        (index[people[name]["mother"]], index[people[name]["father"]])
+        if people[name]["mother"] and people[name]["father"] else None
+        for name in names
+    ]
+    children = [[] for name in names]
+    for child, pair in enumerate(parents):
+        if pair is not None:
+            children[pair[0]].append((child, 0))
+            children[pair[1]].append((child, 1))
+    evidence = [
+        trait[:, int(people[name]["trait"])] if people[name]["trait"] is not None else None
+        for name in names
+    ]
+
+    # start every chain from a forward sample, ignoring the evidence
+    genes = numpy.zeros((chains, len(names)), dtype=numpy.int64)
+    for i, pair in enumerate(parents):
+        distribution = prior if pair is None else inheritance[genes[:, pair[0]], genes[:, pair[1]]]
+        genes[:, i] = sample_genes(distribution, rng, chains)
+
+    # per-chain sums of conditional gene distributions, and of their squares
+    totals = numpy.zeros((chains, len(names), 3))
+    squares = numpy.zeros((chains, len(names), 3))
+    sweeps = 0
+    start = time.perf_counter()
+    while sweeps <= burn_in or sampling_budget((sweeps - burn_in) * chains - (samples or 0), seconds, start):
+        conditionals = numpy.empty((chains, len(names), 3))
+        for i in range(len(names)):
+            if parents[i] is None:
+                distribution = numpy.tile(prior, (chains, 1))
+            else:
+                distribution = inheritance[genes[:, parents[i][0]], genes[:, parents[i][1]]]
+            if evidence[i] is not None:
+                distribution = distribution * evidence[i]
+            for child, role in children[i]:
+                other = genes[:, parents[child][1 - role]]
+                if role == 0:
+                    distribution = distribution * inheritance[:, other, genes[:, child]].T
+                else:
+                    distribution = distribution * inheritance[other, :, genes[:, child]]
+            distribution = distribution / distribution.sum(axis=1, keepdims=True)
+            genes[:, i] = sample_genes(distribution, rng, chains)
+            conditionals[:, i] = distribution
+
+        sweeps += 1
+        if sweeps > burn_in:
+            totals += conditionals
+            squares += conditionals ** 2
+
+    # Gelman-Rubin diagnostic and standard error from the chain means
+    kept = sweeps - burn_in
+    means = totals / kept
+    within = numpy.maximum(squares / kept - means ** 2, 0).mean(axis=0) * kept / max(kept - 1, 1)
+    between = means.var(axis=0, ddof=1) * kept if chains > 1 else numpy.zeros_like(within)
+    pooled = (kept - 1) / kept * within + between / kept
+    rhat = numpy.sqrt(pooled[within > 0] / within[within > 0])
+    genes_p = means.mean(axis=0)
+    error = numpy.sqrt(means.var(axis=0, ddof=1) / chains) if chains > 1 else numpy.zeros_like(genes_p)
+    diagnostics = {
+        "Samples": kept * chains,
+        "Max R-hat": float(rhat.max()) if rhat.size else 1.0,
+        "Max standard error": float(error.max())
+    }
+    return sampled_probabilities(people, names, genes_p, genes_p @ trait[:, 1]), diagnostics
+
+
+def sample_genes(distribution, rng, size):
+    """
+    Return `size` numbers of genes drawn from `distribution`, which is
+    either one distribution over 0, 1 and 2 genes or one per row.
+    """
+    cumulative = numpy.cumsum(numpy.broadcast_to(distribution, (size, 3)), axis=1)
+    draws = rng.random(size) * cumulative[:, -1]
+    return (draws[:, None] >= cumulative[:, :-1]).sum(axis=1)
+
+
+def sampled_probabilities(people, names, genes_p, trait_p):
+    """
+    Return gene and trait probabilities for each person, in the format
+    of enumerate_probabilities, from arrays of estimates indexed like
+    `names`. Known traits are reported as certain.
+    """
+    probabilities = {}
+    for i, name in enumerate(names):
+        has_trait = trait_p[i] if people[name]["trait"] is None else float(people[name]["trait"])
+        probabilities[name] = {
+            "gene": {g: float(genes_p[i, g]) for g in [2, 1, 0]},
+            "trait": {True: float(has_trait), False: float(1 - has_trait)}
+        }
+    return {name: probabilities[name] for name in people}
+
+
 if __name__ == "__main__":
     main()
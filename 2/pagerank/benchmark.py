@@ -0,0 +1,90 @@
+import numpy
+import sys
+import time
+import tracemalloc
+
+from pagerank import DAMPING, TOLERANCE, edge_matrix, power_iteration, sample_walks
+
+SIZES = [1000, 10000, 100000, 1000000, 10000000]
+SAMPLE_COUNTS = [1000, 10000, 100000, 1000000]
+BIAS_RUNS = 20
+LINKS = 8
+EXPONENT = 2.1
+
+# Source pages whose links are generated at a time
+GRAPH_BLOCK = 1000000
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or SIZES
+    for n in sizes:
+        sources, targets = scale_free_graph(n)
+        print(f"Graph with {n} pages and {len(sources)} links")
+
+        (matrix, dangling), elapsed, peak = measure(edge_matrix, n, sources, targets)
+        print(f"  build:     {elapsed:8.3f}s {peak / 2 ** 20:8.1f} MiB")
+
+        for tolerance in [1e-4, 1e-6, TOLERANCE]:
+            (exact, iterations), elapsed, peak = measure(
+                power_iteration, matrix, dangling, DAMPING, tolerance
+            )
+            print(f"  iterate:   {elapsed:8.3f}s {peak / 2 ** 20:8.1f} MiB "
+                  f"{iterations:4} iterations to L1 residual {tolerance:g}")
+
+        for samples in SAMPLE_COUNTS:
+            clicks, elapsed, peak = measure(sample_walks, matrix, dangling, DAMPING, samples)
+            error = numpy.abs(clicks / samples - exact).sum()
+
+            # noise averages out over runs, while a bias of the sampler stays
+            average = clicks / samples
+            for _ in range(BIAS_RUNS - 1):
+                average += sample_walks(matrix, dangling, DAMPING, samples) / samples
+            bias = numpy.abs(average / BIAS_RUNS - exact).sum()
+            print(f"  sample:    {elapsed:8.3f}s {peak / 2 ** 20:8.1f} MiB "
+                  f"L1 error {error:.4f}, of {BIAS_RUNS} runs' average {bias:.4f}, "
+                  f"with {samples} samples")
+
+
+def scale_free_graph(n, links=LINKS, exponent=EXPONENT, seed=0):
+    """
+    Return a tuple (sources, targets) with the links of a random graph
+    of `n` pages, about `links` per page, whose in-degrees follow a power
+    law with the given `exponent` (as in the Chung-Lu model).
+    Some pages end up with no links, as in real corpora.
+    """
+    rng = numpy.random.default_rng(seed)
+    weights = numpy.arange(1, n + 1) ** (-1 / (exponent - 1))
+    weights /= weights.sum()
+
+    # links are drawn for a block of source pages at a time, and kept as
+    # 32-bit page numbers, so that 10 million pages fit in a few GiB
+    sources, targets = [], []
+    for first in range(0, n, GRAPH_BLOCK):
+        size = min(GRAPH_BLOCK, n - first) * links
+        block_sources = rng.integers(first, min(first + GRAPH_BLOCK, n), size=size)
+        block_targets = rng.choice(n, size=size, p=weights)
+
+        # drop self-links and repeated links, like crawl does
+        kept = block_sources != block_targets
+        keys = numpy.unique(block_sources[kept] * n + block_targets[kept])
+        sources.append((keys // n).astype(numpy.int32))
+        targets.append((keys % n).astype(numpy.int32))
+    return numpy.concatenate(sources), numpy.concatenate(targets)
+
+
+def measure(function, *args):
+    """
+    Call `function` with `args`, and return a tuple with its result,
+    the time it took in seconds and its peak memory allocation in bytes.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+if __name__ == "__main__":
+    main()
@@ -1,53 +1,206 @@
+import collections
+import itertools
+import json
+import math
+import mmap
+import multiprocessing
 import os
-import random
 import numpy
 import re
+import scipy.sparse
 import sys
-import copy
+import time
 
 DAMPING = 0.85
 SAMPLES = 10000
+TOLERANCE = 1e-8
+PUSH_TOLERANCE = 1e-5
+QUERY_TOLERANCE = 1e-4
+TOP_K = 10
+WALKERS = 1000
+BURN_IN_TOLERANCE = 1e-3
+SHARD_SIZE = 1000
+
+LINK = re.compile(rb"<a\s+(?:[^>]*?)href=\"([^\"]*)\"")
 
 
 def main():
-    if len(sys.argv) != 2:
-        sys.exit("Usage: python pagerank.py corpus")
-    corpus = crawl(sys.argv[1])
-    ranks = sample_pagerank(corpus, DAMPING, SAMPLES)
-    print(f"PageRank Results from Sampling (n = {SAMPLES})")
+    if len(sys.argv) in [4, 5] and sys.argv[1] == "--update":
+        return main_update(*sys.argv[2:])
+    if len(sys.argv) >= 4 and sys.argv[1] == "--related":
+        return main_related(sys.argv[2], sys.argv[3:])
+    if len(sys.argv) not in [2, 3]:
+        sys.exit("Usage: python pagerank.py corpus [graph]\n"
+                 "       python pagerank.py --update state diff [corpus]\n"
+                 "       python pagerank.py --related corpus page...")
+    graph = sys.argv[2] if len(sys.argv) == 3 else None
+    pages, sources, targets = crawl_graph(sys.argv[1], cache=graph)
+    matrix, dangling = edge_matrix(len(pages), sources, targets)
+
+    start = time.perf_counter()
+    sampled = sample_walks(matrix, dangling, DAMPING, SAMPLES) / SAMPLES
+    elapsed = time.perf_counter() - start
+    ranks = dict(zip(pages, sampled.tolist()))
+    print(f"PageRank Results from Sampling (n = {SAMPLES}, {elapsed:.3f}s)")
+    for page in sorted(ranks):
+        print(f"  {page}: {ranks[page]:.4f}")
+
+    start = time.perf_counter()
+    iterated, iterations = power_iteration(matrix, dangling, DAMPING)
+    elapsed = time.perf_counter() - start
+    ranks = dict(zip(pages, iterated.tolist()))
+    print(f"PageRank Results from Iteration ({iterations} iterations to L1 residual {TOLERANCE:g}, {elapsed:.3f}s)")
     for page in sorted(ranks):
         print(f"  {page}: {ranks[page]:.4f}")
-    ranks = iterate_pagerank(corpus, DAMPING)
-    print(f"PageRank Results from Iteration")
+    print(f"L1 error of sampling: {numpy.abs(sampled - iterated).sum():.4f}")
+
+
+def main_update(path, diff_path, directory=None):
+    """
+    Apply the JSON diff at `diff_path` to the PageRank state saved at
+    `path` (starting from an empty corpus if there is none yet), print
+    the updated ranks and save the new state.
+
+    If the corpus `directory` is given, the state is first rebuilt from
+    it, starting power iteration from the ranks of the saved state.
+    """
+    state = load_state(path) if os.path.exists(path) else empty_state()
+    if directory is not None:
+        ranks = dict(zip(state["pages"], state_ranks(state).tolist()))
+        state = pagerank_state(*crawl_graph(directory), DAMPING, ranks=ranks)
+    with open(diff_path) as f:
+        diff = json.load(f)
+    state, pushes = update_state(state, diff, DAMPING)
+    save_state(path, state)
+    ranks = dict(zip(state["pages"], state_ranks(state).tolist()))
+    print(f"PageRank Results from Incremental Update ({pushes} pushes)")
     for page in sorted(ranks):
         print(f"  {page}: {ranks[page]:.4f}")
 
 
+def main_related(directory, seeds):
+    """
+    Print the pages of the corpus in `directory` most related to `seeds`.
+    """
+    structure = query_structure(*crawl_graph(directory))
+    print(f"Pages Most Related to {', '.join(seeds)}")
+    for page, rank in personalized_pagerank(structure, seeds, DAMPING):
+        print(f"  {page}: {rank:.4f}")
+
+
 def crawl(directory):
     """
     Parse a directory of HTML pages and check for links to other pages.
     Return a dictionary where each key is a page, and values are
-    a list of all other pages in the corpus that are linked to by the page.
+    a set of all other pages in the corpus that are linked to by the page.
     """
-    pages = dict()
+    pages, sources, targets = crawl_graph(directory)
+    corpus = {page: set() for page in pages}
+    for source, target in zip(sources.tolist(), targets.tolist()):
+        corpus[pages[source]].add(pages[target])
+    return corpus
 
-    # Extract all links from HTML files
-    for filename in os.listdir(directory):
-        if not filename.endswith(".html"):
-            continue
-        with open(os.path.join(directory, filename)) as f:
-            contents = f.read()
-            links = re.findall(r"<a\s+(?:[^>]*?)href=\"([^\"]*)\"", contents)
-            pages[filename] = set(links) - {filename}
-
-    # Only include links to other pages in the corpus
-    for filename in pages:
-        pages[filename] = set(
-            link for link in pages[filename]
-            if link in pages
+
+def crawl_graph(directory, cache=None, processes=None):
+    """
+    Parse a directory of HTML pages like crawl, sharding the files
+    across a pool of `processes` when there are many of them.
+
+    Return a tuple (pages, sources, targets), where `pages` is a list of
+    page names and each position of the integer arrays `sources` and
+    `targets` is one link, as indices into `pages`. If `cache` is given,
+    the graph is loaded from that edge file when it was built from the
+    same directory and none of its pages changed since, and the edge
+    file is written otherwise.
+    """
+    pages = sorted(filename for filename in os.listdir(directory) if filename.endswith(".html"))
+    paths = [os.path.join(directory, page) for page in pages]
+    origin = corpus_fingerprint(directory, paths)
+    if cache is not None and os.path.exists(cache):
+        graph = load_graph(cache, origin)
+        if graph is not None and graph[0] == pages:
+            return graph
+    shards = [paths[i:i + SHARD_SIZE] for i in range(0, len(paths), SHARD_SIZE)]
+    if len(shards) > 1:
+        with multiprocessing.Pool(processes) as pool:
+            links = pool.map(extract_links, shards)
+    else:
+        links = map(extract_links, shards)
+
+    # intern links as page indices, keeping only other pages in the corpus
+    index = {page: i for i, page in enumerate(pages)}
+    sources, targets = [], []
+    for source, page_links in enumerate(itertools.chain.from_iterable(links)):
+        for link in page_links:
+            target = index.get(link)
+            if target is not None and target != source:
+                sources.append(source)
+                targets.append(target)
+    sources = numpy.array(sources, dtype=numpy.int32)
+    targets = numpy.array(targets, dtype=numpy.int32)
+
+    if cache is not None:
+        save_graph(cache, pages, sources, targets, origin)
+    return pages, sources, targets
+
+
+def corpus_fingerprint(directory, paths):
+    """
+    Return a tuple (directory, fingerprint) identifying the corpus of
+    HTML files at `paths` in `directory`: its absolute path, and an
+    array with the modification time and size of every file.
+    """
+    fingerprint = numpy.zeros((len(paths), 2), dtype=numpy.int64)
+    for i, path in enumerate(paths):
+        stat = os.stat(path)
+        fingerprint[i] = stat.st_mtime_ns, stat.st_size
+    return os.path.abspath(directory), fingerprint
+
+
+def extract_links(paths):
+    """
+    Return a list with the set of links found in each HTML file of `paths`,
+    reading the files through memory maps.
+    """
+    links = []
+    for path in paths:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                links.append(set())
+                continue
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as contents:
+                links.append(set(os.fsdecode(link) for link in LINK.findall(contents)))
+    return links
+
+
+def save_graph(path, pages, sources, targets, source):
+    """
+    Write a graph returned by crawl_graph to the edge file at `path`,
+    with the `source` it was built from (see corpus_fingerprint).
+    """
+    directory, fingerprint = source
+    with open(path, "wb") as f:
+        numpy.savez(
+            f, pages=numpy.array(pages), sources=sources, targets=targets,
+            directory=numpy.array(directory), fingerprint=fingerprint
         )
 
-    return pages
+
+def load_graph(path, source=None):
+    """
+    Read a graph written by save_graph, as a tuple (pages, sources, targets).
+    If `source` is given, return None unless the graph was built from it.
+    """
+    with numpy.load(path) as graph:
+        if source is not None:
+            directory, fingerprint = source
+            if (
+                "directory" not in graph.files
+                or str(graph["directory"]) != directory
+                or not numpy.array_equal(graph["fingerprint"], fingerprint)
+            ):
+                return None
+        return graph["pages"].tolist(), graph["sources"], graph["targets"]
 
 
 def transition_model(corpus, page, damping_factor):
@@ -78,69 +231,399 @@ def sample_pagerank(corpus, damping_factor, n):
     Return PageRank values for each page by sampling `n` pages
     according to transition model, starting with a page at random.
     """
-    link = random.choice(list(corpus))
-
-    # number of times each page was visited
-    clicks = {}
-    for page in corpus:
-        clicks[page] = 0
+    pages, matrix, dangling = transition_matrix(corpus)
+    clicks = sample_walks(matrix, dangling, damping_factor, n)
 
-    # generate samples by clicking links at random following distribution code
-    for i in range(n):
-        distribution = transition_model(corpus, link, damping_factor)
-        link = numpy.random.choice(list(corpus), p=list(distribution.values()))
-        clicks[link] += 1
-    
     # calculate PageRank of each page
-    ranks = {}
-    for page in corpus:
-        ranks[page] = clicks[page] / n
+    return dict(zip(pages, (clicks / n).tolist()))
 
-    return ranks
 
+def sample_walks(matrix, dangling, damping_factor, n, walkers=WALKERS, rng=None):
+    """
+    Return an array with the number of times each page was visited by
+    `n` samples of the random surfer, given the link structure built by
+    transition_matrix.
 
-def iterate_pagerank(corpus, damping_factor):
+    The samples are drawn by up to `walkers` independent surfers that
+    move in lockstep, each starting at a page chosen at random. Surfers
+    first take `burn_in_steps` uncounted steps, so that the few steps
+    each one counts are not biased towards their uniform starting pages.
+    """
+    rng = numpy.random.default_rng() if rng is None else rng
+    pages = matrix.shape[0]
+
+    # column j of the transposed matrix lists the pages linked to by page j
+    links = matrix.tocsc()
+    starts = links.indptr[:-1]
+    degrees = numpy.diff(links.indptr)
+
+    walkers = max(1, min(walkers, n))
+    current = rng.integers(pages, size=walkers)
+    clicks = numpy.zeros(pages, dtype=numpy.int64)
+
+    # each step, every surfer either follows a random link or jumps anywhere
+    burn_in = burn_in_steps(damping_factor)
+    remaining = n
+    while remaining > 0:
+        follow = ~dangling[current] & (rng.random(walkers) < damping_factor)
+        surfers = current[follow]
+        offsets = starts[surfers] + (rng.random(len(surfers)) * degrees[surfers]).astype(numpy.int64)
+        current = rng.integers(pages, size=walkers)
+        current[follow] = links.indices[offsets]
+        if burn_in > 0:
+            burn_in -= 1
+            continue
+        clicks += numpy.bincount(current[:remaining], minlength=pages)
+        remaining -= walkers
+
+    return clicks
+
+
+def burn_in_steps(damping_factor, tolerance=BURN_IN_TOLERANCE):
+    """
+    Return the number of steps after which a surfer's starting page
+    weighs less than `tolerance` on where it is: a surfer keeps following
+    links for k steps with probability `damping_factor` ** k.
+    """
+    if damping_factor <= 0:
+        return 0
+    if damping_factor >= 1:
+        raise ValueError("Damping factor must be below 1 to sample")
+    return math.ceil(math.log(tolerance) / math.log(damping_factor))
+
+
+def iterate_pagerank(corpus, damping_factor, tolerance=TOLERANCE):
     """
     Return PageRank values for each page by iteratively updating
-    PageRank values until convergence.
+    PageRank values until convergence, i.e. until the total (L1)
+    change of all PageRank values in one iteration is below `tolerance`.
 
     Return a dictionary where keys are page names, and values are
     their estimated PageRank value (a value between 0 and 1). All
     PageRank values should sum to 1.
     """
-    # define initial rank, equal for every page
-    ranks = {}
-    for page in corpus:
-        ranks[page] = 1 / len(corpus)
-    
-    # iterate until convergence in all PageRanks
+    pages, matrix, dangling = transition_matrix(corpus)
+    ranks, iterations = power_iteration(matrix, dangling, damping_factor, tolerance)
+    return dict(zip(pages, ranks.tolist()))
+
+
+def transition_matrix(corpus):
+    """
+    Build the link structure of `corpus` once, as a sparse matrix.
+
+    Return a tuple (pages, matrix, dangling), where `pages` is a list
+    fixing the index of every page, `matrix` is a CSR matrix whose entry
+    [i, j] is the probability of following a link from page j to page i,
+    and `dangling` is a boolean array marking pages with no links.
+    """
+    pages = list(corpus)
+    index = {page: i for i, page in enumerate(pages)}
+    sources = numpy.fromiter((i for i, page in enumerate(pages) for link in corpus[page]), dtype=numpy.int64)
+    targets = numpy.fromiter((index[link] for page in pages for link in corpus[page]), dtype=numpy.int64)
+    matrix, dangling = edge_matrix(len(pages), sources, targets)
+    return pages, matrix, dangling
+
+
+def edge_matrix(n, sources, targets):
+    """
+    Return a tuple (matrix, dangling) as described in transition_matrix,
+    for a graph of `n` pages with a link from each of `sources` to the
+    page at the same position of `targets`.
+    """
+    # one (row, column) pair per link, weighted by the out-degree of its source
+    degrees = numpy.bincount(sources, minlength=n)
+    weights = 1 / degrees[sources]
+    matrix = scipy.sparse.csr_matrix((weights, (targets, sources)), shape=(n, n))
+    return matrix, degrees == 0
+
+
+def power_iteration(matrix, dangling, damping_factor, tolerance=TOLERANCE, ranks=None):
+    """
+    Return a tuple (ranks, iterations) with the PageRank vector of the
+    graph described by `matrix` and `dangling` (see transition_matrix),
+    iterating until the L1 change between sweeps is below `tolerance`.
+    Iteration starts from `ranks` when given, e.g. a previous result.
+
+    Pages with no links behave as if having one link for every page,
+    which is applied as a rank-one correction instead of dense columns.
+    """
+    n = matrix.shape[0]
+    ranks = numpy.full(n, 1 / n) if ranks is None else ranks
+    iterations = 0
+
     while True:
-        
-        previous_ranks = copy.deepcopy(ranks)
-        convergence = 0
-        for page in corpus:
-
-            # get group of pages that link to current page 
-            # (if page has no links, behave as if having one link for every page - including itself)
-            links = {}
-            for link in corpus:
-                if len(corpus[link]) == 0 or page in corpus[link]:
-                    links[link] = link
-
-            # get PageRank
-            sum = 0
-            for i in links:
-                sum += ranks[i] / len(corpus[i])
-            ranks[page] = ((1 - damping_factor) / len(corpus)) + (damping_factor * sum)
-            
-            # check for convergence
-            if abs(ranks[page] - previous_ranks[page]) < 0.001:
-                convergence += 1
-        
-        if convergence == len(corpus):
+        iterations += 1
+        dangling_mass = ranks[dangling].sum()
+        new_ranks = (1 - damping_factor) / n + damping_factor * (matrix @ ranks + dangling_mass / n)
+        residual = numpy.abs(new_ranks - ranks).sum()
+        ranks = new_ranks
+        if residual < tolerance:
             break
-    
-    return ranks
+
+    return ranks, iterations
+
+
+def empty_state():
+    """
+    Return the incremental PageRank state of a corpus with no pages.
+    """
+    return {
+        "pages": [],
+        "sources": numpy.zeros(0, dtype=numpy.int32),
+        "targets": numpy.zeros(0, dtype=numpy.int32),
+        "scores": numpy.zeros(0),
+        "residual": numpy.zeros(0)
+    }
+
+
+def pagerank_state(pages, sources, targets, damping_factor, tolerance=PUSH_TOLERANCE, ranks=None):
+    """
+    Return the incremental PageRank state of a graph returned by
+    crawl_graph, computed with power_iteration, which starts from the
+    previous PageRank of each page if given a dictionary of `ranks`.
+
+    Besides the graph, the state keeps unnormalized `scores` solving
+    scores = (1 - d) + d * matrix @ scores, whose normalization is the
+    PageRank vector, and the `residual` of that equation. Unlike the
+    ranks, scores do not depend on the number of pages or on pages
+    without links, so corpus changes only perturb them locally. Every
+    residual is left below `tolerance`.
+    """
+    matrix, dangling = edge_matrix(len(pages), sources, targets)
+    n = len(pages)
+    start = None
+    if ranks:
+        start = numpy.array([ranks.get(page, 1 / n) for page in pages])
+        start /= start.sum()
+    ranks, iterations = power_iteration(matrix, dangling, damping_factor, ranks=start)
+    scores = ranks * n * (1 - damping_factor) / ((1 - damping_factor) + damping_factor * ranks[dangling].sum())
+    residual = (1 - damping_factor) - scores + damping_factor * (matrix @ scores)
+
+    # polish with synchronous pushes so that no page is left above tolerance
+    while n > 0 and numpy.abs(residual).max() > tolerance:
+        scores += residual
+        residual = (1 - damping_factor) - scores + damping_factor * (matrix @ scores)
+
+    return {
+        "pages": list(pages),
+        "sources": sources,
+        "targets": targets,
+        "scores": scores,
+        "residual": residual
+    }
+
+
+def state_ranks(state):
+    """
+    Return the PageRank vector of an incremental state.
+    """
+    return state["scores"] / state["scores"].sum()
+
+
+def update_state(state, diff, damping_factor, tolerance=PUSH_TOLERANCE):
+    """
+    Apply `diff` to an incremental PageRank state and return a tuple
+    (state, pushes) with the updated state and the number of pushes made.
+
+    `diff` is a dictionary which may contain lists "add_pages" and
+    "remove_pages" of page names, and "add_links" and "remove_links" of
+    [source, target] pairs. Only the residual of pages whose incoming
+    links changed is updated, and forward push (Gauss-Southwell) then
+    spreads it from those pages until every residual is below `tolerance`.
+    """
+    pages = state["pages"]
+    index = {page: i for i, page in enumerate(pages)}
+    removed = numpy.zeros(len(pages), dtype=bool)
+    removed[[index[page] for page in diff.get("remove_pages", []) if page in index]] = True
+
+    # new index of every page, with added pages after the remaining ones
+    remap = numpy.cumsum(~removed) - 1
+    remap[removed] = -1
+    new_pages = [page for page, gone in zip(pages, removed) if not gone]
+    new_pages += [page for page in dict.fromkeys(diff.get("add_pages", [])) if page not in index or removed[index[page]]]
+    new_index = {page: i for i, page in enumerate(new_pages)}
+    n = len(new_pages)
+
+    # keep old links unless removed or touching a removed page, then add new ones
+    sources, targets = state["sources"], state["targets"]
+    dropped = removed[sources] | removed[targets]
+    removed_links = [(index[s], index[t]) for s, t in diff.get("remove_links", []) if s in index and t in index]
+    if removed_links:
+        keys = sources.astype(numpy.int64) * len(pages) + targets
+        dropped |= numpy.isin(keys, [s * len(pages) + t for s, t in removed_links])
+    kept_sources, kept_targets = remap[sources[~dropped]], remap[targets[~dropped]]
+    added_links = list(dict.fromkeys(
+        (new_index[s], new_index[t]) for s, t in diff.get("add_links", [])
+        if s in new_index and t in new_index and s != t
+    ))
+    if added_links:
+        keys = kept_sources.astype(numpy.int64) * n + kept_targets
+        added_links = [
+            link for link, exists in zip(added_links, numpy.isin([s * n + t for s, t in added_links], keys))
+            if not exists
+        ]
+    new_sources = numpy.concatenate([kept_sources, [s for s, t in added_links]]).astype(numpy.int32)
+    new_targets = numpy.concatenate([kept_targets, [t for s, t in added_links]]).astype(numpy.int32)
+
+    # pages whose links changed, by their new and old index
+    kept = numpy.flatnonzero(~removed)
+    changed_new = numpy.unique(numpy.concatenate([
+        remap[sources[dropped]][~removed[sources[dropped]]], [s for s, t in added_links]
+    ])).astype(numpy.int64)
+    changed_old = numpy.unique(numpy.concatenate([
+        numpy.flatnonzero(removed), kept[changed_new[changed_new < len(kept)]]
+    ])).astype(numpy.int64)
+
+    # take away the old contribution of changed pages, then add the new one
+    old_scores = state["scores"]
+    residual = numpy.full(n, 1 - damping_factor)
+    residual[:len(kept)] = state["residual"][kept] - link_contribution(
+        sources, targets, old_scores, changed_old, damping_factor, len(pages)
+    )[kept]
+    scores = numpy.zeros(n)
+    scores[:len(kept)] = old_scores[kept]
+    residual += link_contribution(new_sources, new_targets, scores, changed_new, damping_factor, n)
+
+    links = edge_matrix(n, new_sources, new_targets)[0].tocsc()
+    pushes = forward_push(links.indptr, links.indices, damping_factor, scores, residual, tolerance)
+    return {
+        "pages": new_pages,
+        "sources": new_sources,
+        "targets": new_targets,
+        "scores": scores,
+        "residual": residual
+    }, pushes
+
+
+def link_contribution(sources, targets, scores, pages, damping_factor, n):
+    """
+    Return an array with the score each of `n` pages receives through
+    the links of `pages`, weighted by `damping_factor`.
+    """
+    degrees = numpy.bincount(sources, minlength=n)
+    selected = numpy.isin(sources, pages)
+    sources, targets = sources[selected], targets[selected]
+    return numpy.bincount(targets, weights=damping_factor * scores[sources] / degrees[sources], minlength=n)
+
+
+def forward_push(indptr, indices, damping_factor, scores, residual, tolerance):
+    """
+    Move residual into `scores` in place, pushing the residual of a page
+    onto the pages it links to, until every residual is below `tolerance`.
+    The links of page j are indices[indptr[j]:indptr[j + 1]].
+
+    Return the number of pushes made.
+    """
+    queue = collections.deque(numpy.flatnonzero(numpy.abs(residual) > tolerance).tolist())
+    queued = set(queue)
+    pushes = 0
+
+    while queue:
+        page = queue.popleft()
+        queued.discard(page)
+        mass = residual[page]
+        scores[page] += mass
+        residual[page] = 0
+        pushes += 1
+
+        start, end = indptr[page], indptr[page + 1]
+        if start == end:
+            continue
+        links = indices[start:end]
+        residual[links] += damping_factor * mass / (end - start)
+        for link in links[numpy.abs(residual[links]) > tolerance].tolist():
+            if link not in queued:
+                queued.add(link)
+                queue.append(link)
+
+    return pushes
+
+
+def query_structure(pages, sources, targets):
+    """
+    Return a tuple (pages, index, links) to answer personalized queries
+    on a graph returned by crawl_graph, where `index` maps page names to
+    their position and `links` is the transition matrix in CSC form.
+    """
+    links = edge_matrix(len(pages), sources, targets)[0].tocsc()
+    return list(pages), {page: i for i, page in enumerate(pages)}, links
+
+
+def personalized_pagerank(structure, seeds, damping_factor, k=TOP_K, tolerance=QUERY_TOLERANCE):
+    """
+    Return the `k` pages with the highest personalized PageRank for the
+    teleport distribution `seeds`, as a list of (page, rank) pairs in
+    decreasing order of rank.
+
+    `structure` comes from query_structure, and `seeds` is either a
+    dictionary mapping pages to weights or a list of equally weighted
+    pages. Ranks are approximated by forward push, which stops once no
+    page holds more than `tolerance` residual and so only visits pages
+    near the seeds. Pages with no links jump back to the seeds.
+    """
+    pages, index, links = structure
+    if not isinstance(seeds, dict):
+        seeds = dict.fromkeys(seeds, 1)
+    seeds = {index[page]: weight for page, weight in seeds.items() if page in index}
+    if not seeds:
+        return []
+
+    scores = numpy.zeros(len(pages))
+    residual = numpy.zeros(len(pages))
+    total = sum(seeds.values())
+    for page, weight in seeds.items():
+        residual[page] = (1 - damping_factor) * weight / total
+    forward_push(links.indptr, links.indices, damping_factor, scores, residual, tolerance)
+
+    # partial sort of the pages that were reached
+    reached = numpy.flatnonzero(scores)
+    if len(reached) > k:
+        reached = reached[numpy.argpartition(scores[reached], -k)[-k:]]
+    reached = reached[numpy.argsort(-scores[reached], kind="stable")]
+    ranks = scores[reached] / scores.sum()
+    return [(pages[page], rank) for page, rank in zip(reached.tolist(), ranks.tolist())]
+
+
+def personalized_batch(structure, queries, damping_factor, k=TOP_K, processes=None):
+    """
+    Return a list with the result of personalized_pagerank for every
+    seed distribution in `queries`, answered by a pool of `processes`.
+    """
+    with multiprocessing.Pool(processes, initializer=set_query_structure, initargs=(structure,)) as pool:
+        return pool.starmap(personalized_query, [(seeds, damping_factor, k) for seeds in queries])
+
+
+def set_query_structure(structure):
+    """
+    Keep the query structure of a personalized_batch worker process.
+    """
+    global query
+    query = structure
+
+
+def personalized_query(seeds, damping_factor, k):
+    """
+    Answer one query of personalized_batch in a worker process.
+    """
+    return personalized_pagerank(query, seeds, damping_factor, k)
+
+
+def save_state(path, state):
+    """
+    Write an incremental PageRank state to the file at `path`.
+    """
+    with open(path, "wb") as f:
+        numpy.savez(f, **{**state, "pages": numpy.array(state["pages"])})
+
+
+def load_state(path):
+    """
+    Read an incremental PageRank state written by save_state.
+    """
+    with numpy.load(path) as data:
+        state = {key: data[key] for key in data.files}
+    state["pages"] = state["pages"].tolist()
+    return state
 
 
 
@@ -0,0 +1,214 @@
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from generate import *
+
+STRUCTURES = ["data/structure0.txt", "data/structure1.txt", "data/structure2.txt"]
+WORDS = ["data/words0.txt", "data/words1.txt", "data/words2.txt"]
+REPEAT = 5
+
+# Generated grids: (height, width) sizes, fractions of blocked cells,
+# and whether the grid is rotationally symmetric
+SIZES = [(5, 5), (9, 9), (13, 13)]
+DENSITIES = [0.2, 0.35]
+SEEDS = [0, 1]
+
+# Dictionaries: the largest real list, and a synthetic one of this many
+# words drawn with English letter frequencies
+REAL_WORDS = "data/words2.txt"
+SYNTHETIC_WORDS = 50000
+LETTERS = "EEEEEEEEEEEETTTTTTTTTAAAAAAAAOOOOOOOOIIIIIIINNNNNNNSSSSSSHHHHHHRRRRRRDDDDLLLLUUUCCCMMMWWFFGGYYPPBVKJXQZ"
+
+# Seconds allowed for each search
+TIME_LIMIT = 10
+
+
+def main():
+    if len(sys.argv) == 2 and sys.argv[1] == "--ac3":
+        return compare_ac3()
+    if len(sys.argv) > 2:
+        sys.exit("Usage: python benchmark.py [results.json | --ac3]")
+
+    with tempfile.TemporaryDirectory() as directory:
+        words_files = {
+            "real": REAL_WORDS,
+            "synthetic": synthetic_words(os.path.join(directory, "words.txt"))
+        }
+        results = []
+        print(f"{'grid':<28}{'words':<11}{'vars':>5}{'node':>8}{'ac3':>8}{'search':>8}"
+              f"{'nodes/s':>10}{'backtracks/s':>14}{'revisions/s':>13}  result")
+        for height, width in SIZES:
+            for density in DENSITIES:
+                for symmetric in [False, True]:
+                    for seed in SEEDS:
+                        structure = os.path.join(directory, "structure.txt")
+                        write_grid(structure, height, width, density, symmetric, seed)
+                        grid = {
+                            "height": height, "width": width, "density": density,
+                            "symmetric": symmetric, "seed": seed
+                        }
+                        for name, words in words_files.items():
+                            result = run(structure, words)
+                            results.append({"grid": grid, "words": name, **result})
+                            report(grid, name, result)
+
+    if len(sys.argv) == 2:
+        with open(sys.argv[1], "w") as f:
+            json.dump(results, f, indent=2)
+
+
+def run(structure, words):
+    """
+    Solve the crossword of the `structure` and `words` files, timing
+    node consistency, arc consistency and the search separately.
+    Return a dictionary of timings, search statistics and the outcome.
+    """
+    creator = CrosswordCreator(Crossword(structure, words))
+    times = dict()
+
+    start = time.perf_counter()
+    creator.enforce_node_consistency()
+    times["node_consistency"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    consistent = creator.ac3()
+    times["ac3"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    creator.trail = []
+    creator.deadline = time.time() + TIME_LIMIT
+    if not consistent:
+        outcome = "unsolvable"
+    else:
+        try:
+            assignment = creator.backtrack_mac(dict(), set())
+            outcome = "solved" if assignment is not None else "unsolvable"
+        except Restart:
+            outcome = "timeout"
+    times["backtrack"] = time.perf_counter() - start
+
+    total = sum(times.values())
+    statistics = creator.statistics
+    return {
+        "variables": len(creator.crossword.variables),
+        "times": times,
+        "statistics": statistics,
+        "rates": {
+            "nodes": statistics["nodes"] / max(times["backtrack"], 1e-9),
+            "backtracks": statistics["backtracks"] / max(times["backtrack"], 1e-9),
+            "revisions": statistics["revisions"] / max(total, 1e-9)
+        },
+        "outcome": outcome
+    }
+
+
+def report(grid, words, result):
+    """
+    Print one line of the results table.
+    """
+    name = (f"{grid['height']}x{grid['width']} {grid['density']:.2f} "
+            f"{'sym' if grid['symmetric'] else 'rand'} #{grid['seed']}")
+    times, rates = result["times"], result["rates"]
+    print(f"{name:<28}{words:<11}{result['variables']:>5}"
+          f"{times['node_consistency']:>7.3f}s{times['ac3']:>7.3f}s{times['backtrack']:>7.3f}s"
+          f"{rates['nodes']:>10.0f}{rates['backtracks']:>14.0f}{rates['revisions']:>13.0f}  {result['outcome']}")
+
+
+def write_grid(filename, height, width, density, symmetric, seed):
+    """
+    Write a random crossword structure to `filename`, with about
+    `density` of its cells blocked. A symmetric grid looks the same
+    when rotated by 180 degrees, like most published crosswords.
+    """
+    rng = random.Random(seed)
+    grid = [["_"] * width for _ in range(height)]
+    for i in range(height):
+        for j in range(width):
+            if rng.random() < density:
+                grid[i][j] = "#"
+    if symmetric:
+        for i in range(height):
+            for j in range(width):
+                grid[height - 1 - i][width - 1 - j] = grid[i][j]
+    with open(filename, "w") as f:
+        f.write("\n".join("".join(row) for row in grid) + "\n")
+
+
+def synthetic_words(filename, count=SYNTHETIC_WORDS, seed=0):
+    """
+    Write `count` random words of 2 to 13 letters, drawn with English
+    letter frequencies, to `filename` and return it.
+    """
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < count:
+        words.add("".join(rng.choice(LETTERS) for _ in range(rng.randint(2, 13))))
+    with open(filename, "w") as f:
+        f.write("\n".join(sorted(words)) + "\n")
+    return filename
+
+
+def compare_ac3():
+    """
+    Print the time and number of revisions of AC-3 with a plain list
+    as worklist and with the deduplicated deque, for every given
+    structure and words file.
+    """
+    print(f"{'structure':<22}{'words':<18}{'list ac3':>10}{'deque ac3':>11}{'revisions':>16}")
+    for structure in STRUCTURES:
+        for words in WORDS:
+            crossword = Crossword(structure, words)
+            baseline, baseline_revisions = time_ac3(crossword, list_ac3)
+            current, current_revisions = time_ac3(crossword, CrosswordCreator.ac3)
+            print(f"{structure:<22}{words:<18}{baseline:>9.4f}s{current:>10.4f}s"
+                  f"{baseline_revisions:>8} -> {current_revisions:<6}")
+
+
+def time_ac3(crossword, ac3):
+    """
+    Return a tuple with the best time, in seconds, of `REPEAT` runs of
+    `ac3` after node consistency, and the number of arcs it revised.
+    """
+    best = None
+    for _ in range(REPEAT):
+        creator = CrosswordCreator(crossword)
+        creator.enforce_node_consistency()
+        start = time.perf_counter()
+        ac3(creator)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, creator.statistics["revisions"]
+
+
+def list_ac3(creator):
+    """
+    AC-3 with a plain list as the worklist, for comparison: arcs are
+    popped from the front, may be queued more than once, and neighbors
+    are found by scanning every variable.
+    """
+    crossword = creator.crossword
+    arcs = [
+        (v1, v2) for (v1, v2), overlap in crossword.overlaps.items()
+        if overlap is not None
+    ]
+    while len(arcs) != 0:
+        x, y = arcs.pop(0)
+        if creator.revise(x, y):
+            if not creator.domains[x]:
+                return False
+            neighbors = set(
+                v for v in crossword.variables
+                if v != x and crossword.overlaps[v, x]
+            )
+            for z in neighbors:
+                if z is not y:
+                    arcs.append((z, x))
+    return True
+
+
+if __name__ == "__main__":
+    main()
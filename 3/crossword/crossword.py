@@ -1,3 +1,10 @@
+import functools
+import hashlib
+import os
+import struct
+import tempfile
+
+
 class Variable():
 
     ACROSS = "across"
@@ -35,6 +42,209 @@ class Variable():
         return f"Variable({self.i}, {self.j}, {direction}, {self.length})"
 
 
+class WordStore():
+    """
+    Vocabulary bucketed by word length. Each bucket keeps its words,
+    sorted, as one fixed-width byte string, and for every position and
+    letter a bitmap (an int used as a bitset) of the words with that
+    letter at that position, so that sets of words and pattern queries
+    such as "?A??E" are bitsets into the bucket.
+    """
+
+    ENCODING = "utf-32-le"
+    WIDTH = 4
+    VERSION = 4
+
+    # Cached stores, a header and raw bytes so that loading runs no code
+    MAGIC = b"WORDSTORE"
+    CACHE_DIR = os.path.join(
+        os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+        "crossword"
+    )
+
+    def __init__(self, words):
+        """Create a new word store from an iterable of words."""
+        self.buckets = dict()
+        self.bitmaps = dict()
+        lengths = dict()
+        for word in set(words):
+            lengths.setdefault(len(word), []).append(word)
+        for length, bucket in lengths.items():
+            bucket.sort()
+            self.buckets[length] = "".join(bucket).encode(WordStore.ENCODING)
+            self.bitmaps[length] = []
+            for k in range(length):
+                positions = dict()
+                for i, word in enumerate(bucket):
+                    positions.setdefault(word[k], []).append(i)
+                self.bitmaps[length].append({
+                    letter: to_bitset(indices, len(bucket))
+                    for letter, indices in positions.items()
+                })
+
+    @classmethod
+    def load(cls, words_file, cache_dir=None):
+        """
+        Return the word store of `words_file`, read from its file in
+        `cache_dir` (by default, CACHE_DIR) if that was built from the
+        same words, or built and cached otherwise.
+        """
+        with open(words_file, "rb") as f:
+            contents = f.read()
+        fingerprint = hashlib.sha256(contents).digest()
+        cache_dir = cache_dir or WordStore.CACHE_DIR
+        name = hashlib.sha256(os.path.abspath(words_file).encode()).hexdigest()[:16]
+        cache_file = os.path.join(cache_dir, name + ".store")
+        try:
+            with open(cache_file, "rb") as f:
+                return cls.from_bytes(f.read(), fingerprint)
+        except (OSError, ValueError, struct.error, UnicodeDecodeError):
+            pass
+
+        store = cls(contents.decode().upper().splitlines())
+
+        # write to a temporary file first, so that readers never see half a cache
+        temporary = None
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            with tempfile.NamedTemporaryFile("wb", dir=cache_dir, delete=False) as f:
+                temporary = f.name
+                f.write(store.to_bytes(fingerprint))
+            os.replace(temporary, cache_file)
+        except OSError:
+            if temporary is not None:
+                try:
+                    os.remove(temporary)
+                except OSError:
+                    pass
+        return store
+
+    def to_bytes(self, fingerprint):
+        """
+        Return the store as bytes: a header with the format version and
+        the `fingerprint` of its words, then for each length the bucket
+        and the bitmaps of every position and letter, each preceded by
+        its size.
+        """
+        parts = [WordStore.MAGIC, struct.pack("<I32sI", WordStore.VERSION, fingerprint, len(self.buckets))]
+        for length, bucket in self.buckets.items():
+            parts.append(struct.pack("<II", length, len(bucket)))
+            parts.append(bucket)
+            for letters in self.bitmaps[length]:
+                parts.append(struct.pack("<I", len(letters)))
+                for letter, bits in letters.items():
+                    data = bits.to_bytes((bits.bit_length() + 7) // 8, "little")
+                    parts.append(struct.pack("<II", ord(letter), len(data)))
+                    parts.append(data)
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data, fingerprint):
+        """
+        Return the store written by `to_bytes` in `data`. Raise ValueError
+        if `data` has another format version or `fingerprint`.
+        """
+        if not data.startswith(WordStore.MAGIC):
+            raise ValueError("not a word store")
+        offset = len(WordStore.MAGIC)
+        version, cached, count = struct.unpack_from("<I32sI", data, offset)
+        offset += struct.calcsize("<I32sI")
+        if version != WordStore.VERSION or cached != fingerprint:
+            raise ValueError("stale word store")
+
+        store = cls([])
+        for _ in range(count):
+            length, size = struct.unpack_from("<II", data, offset)
+            offset += 8
+            store.buckets[length] = data[offset:offset + size]
+            offset += size
+            store.bitmaps[length] = []
+            for _ in range(length):
+                letters = dict()
+                (n,) = struct.unpack_from("<I", data, offset)
+                offset += 4
+                for _ in range(n):
+                    letter, size = struct.unpack_from("<II", data, offset)
+                    offset += 8
+                    letters[chr(letter)] = int.from_bytes(data[offset:offset + size], "little")
+                    offset += size
+                store.bitmaps[length].append(letters)
+        if offset != len(data):
+            raise ValueError("truncated word store")
+        return store
+
+    def size(self, length):
+        """Return the number of words with `length` letters."""
+        return len(self.buckets.get(length, b"")) // (length * WordStore.WIDTH or 1)
+
+    def word(self, length, i):
+        """Return the `i`th word with `length` letters."""
+        width = length * WordStore.WIDTH
+        return self.buckets[length][i * width:(i + 1) * width].decode(WordStore.ENCODING)
+
+    def all(self, length):
+        """Return the bitset of every word with `length` letters."""
+        return (1 << self.size(length)) - 1
+
+    def match(self, pattern):
+        """
+        Return the bitset of words matching `pattern`, where "?" matches
+        any letter, e.g. "?A??E".
+        """
+        if len(pattern) not in self.bitmaps:
+            return 0
+        bits = self.all(len(pattern))
+        for k, letter in enumerate(pattern):
+            if letter != "?":
+                bits &= self.bitmaps[len(pattern)][k].get(letter, 0)
+        return bits
+
+    def letters(self, length, k):
+        """
+        Return a dictionary mapping each letter found at position `k` of
+        words with `length` letters to the bitset of those words.
+        """
+        return self.bitmaps[length][k] if length in self.bitmaps else {}
+
+    def words(self, length, bits=None):
+        """
+        Return the list of words with `length` letters in the bitset
+        `bits`, or all of them if `bits` is None.
+        """
+        if length not in self.buckets:
+            return []
+        width = length * WordStore.WIDTH
+        bucket = self.buckets[length]
+        if bits is None:
+            return [
+                bucket[i:i + width].decode(WordStore.ENCODING)
+                for i in range(0, len(bucket), width)
+            ]
+        return [
+            bucket[i * width:(i + 1) * width].decode(WordStore.ENCODING)
+            for i in from_bitset(bits)
+        ]
+
+
+def to_bitset(indices, n):
+    """Return an int with bits `indices` set, out of `n` bits."""
+    bits = bytearray((n + 7) // 8)
+    for i in indices:
+        bits[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(bits, "little")
+
+
+def from_bitset(bits):
+    """Return the list of indices of the bits set in `bits`."""
+    binary = bin(bits)[:1:-1]
+    indices = []
+    i = binary.find("1")
+    while i != -1:
+        indices.append(i)
+        i = binary.find("1", i + 1)
+    return indices
+
+
 class Crossword():
 
     def __init__(self, structure_file, words_file):
@@ -57,9 +267,8 @@ class Crossword():
                         row.append(False)
                 self.structure.append(row)
 
-        # Save vocabulary list
-        with open(words_file) as f:
-            self.words = set(f.read().upper().splitlines())
+        # Save vocabulary, as a store of words by length
+        self.store = WordStore.load(words_file)
 
         # Determine variable set
         self.variables = set()
@@ -125,9 +334,23 @@ class Crossword():
                         cells2.index(intersection)
                     )
 
+        # Adjacency list: the set of variables overlapping each variable
+        self.adjacency = {
+            var: frozenset(
+                v for v in self.variables
+                if v != var and self.overlaps[v, var]
+            )
+            for var in self.variables
+        }
+
     def neighbors(self, var):
-        """Given a variable, return set of overlapping variables."""
+        """Given a variable, return the frozen set of overlapping variables."""
+        return self.adjacency[var]
+
+    @functools.cached_property
+    def words(self):
+        """Return the set of words in the vocabulary, built on first use."""
         return set(
-            v for v in self.variables
-            if v != var and self.overlaps[v, var]
+            word for length in self.store.buckets
+            for word in self.store.words(length)
         )
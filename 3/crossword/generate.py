@@ -1,7 +1,20 @@
+import heapq
+import multiprocessing
+import os
+import random
 import sys
+import time
 
+from collections import deque
 from crossword import *
 
+# Failures allowed before the first restart, scaled by the Luby sequence
+RESTART_UNIT = 100
+
+
+class Restart(Exception):
+    """Raised to abandon a search that hit its failure limit or deadline."""
+
 
 class CrosswordCreator():
 
@@ -10,11 +23,36 @@ class CrosswordCreator():
         Create new CSP crossword generate.
         """
         self.crossword = crossword
+
+        # Domains are bitsets into the words of each variable's length in
+        # the store; they should be changed with `set_domain`
         self.domains = {
-            var: self.crossword.words.copy()
+            var: self.crossword.store.all(var.length)
             for var in self.crossword.variables
         }
 
+        # Domains replaced since search started, as (var, bits) pairs of
+        # their previous bitsets, so that they can be restored on
+        # backtrack; None when unused
+        self.trail = None
+
+        # If set, order_domain_values only sorts the best `order_limit`
+        # values, leaving the rest in arbitrary order after them
+        self.order_limit = None
+
+        # Source of random tie-breaking for variables and values, if any
+        self.random = None
+
+        # Failures seen by backtrack_mac, and the limit and deadline (in
+        # time.time() seconds) past which it raises Restart, if any
+        self.failures = 0
+        self.fail_limit = None
+        self.deadline = None
+
+        # Search statistics: assignments tried, assignments undone and
+        # arcs revised
+        self.statistics = {"nodes": 0, "backtracks": 0, "revisions": 0}
+
     def letter_grid(self, assignment):
         """
         Return 2D array representing a given assignment.
@@ -85,12 +123,16 @@ class CrosswordCreator():
 
         img.save(filename)
 
-    def solve(self):
+    def solve(self, inference=True):
         """
         Enforce node and arc consistency, and then solve the CSP.
+        If `inference` is True, maintain arc consistency during the search.
         """
         self.enforce_node_consistency()
         self.ac3()
+        if inference:
+            self.trail = []
+            return self.backtrack_mac(dict(), set())
         return self.backtrack(dict())
 
 
@@ -100,11 +142,9 @@ class CrosswordCreator():
         (Remove any values that are inconsistent with a variable's unary
          constraints; in this case, the length of the word.)
         """
-        for v, words in self.domains.items():
-            # delete words of different length
-            for word in words.copy():
-                if len(word) != v.length:
-                    words.discard(word)
+        for v in self.domains:
+            # keep only words of the variable's length
+            self.set_domain(v, self.domains[v] & self.crossword.store.match("?" * v.length))
 
 
     def revise(self, x, y):
@@ -116,21 +156,54 @@ class CrosswordCreator():
         Return True if a revision was made to the domain of `x`; return
         False if no revision was made.
         """
-        revision = False
-        if self.crossword.overlaps[x, y] is not None:
-            x_index, y_index = self.crossword.overlaps[x, y]
-            for word1 in self.domains[x].copy():
-                # search for a match in overlap, discard words without match
-                match = False
-                for word2 in self.domains[y].copy():
-                    if word1[x_index] == word2[y_index]:
-                        match = True
-                        break
-                if not match:
-                    self.domains[x].discard(word1)
-                    revision = True
-                    
-        return revision
+        self.statistics["revisions"] += 1
+        if self.crossword.overlaps[x, y] is None:
+            return False
+        x_index, y_index = self.crossword.overlaps[x, y]
+        store = self.crossword.store
+
+        # keep words whose letter at the overlap has a match in `y`; the
+        # letters of `y` are tested with one AND per bitmap rather than
+        # read from support counts, which cost more to keep up to date on
+        # every pruning than they save here
+        supported = 0
+        x_letters = store.letters(x.length, x_index)
+        for letter, bits in store.letters(y.length, y_index).items():
+            if self.domains[y] & bits:
+                supported |= x_letters.get(letter, 0)
+        domain = self.domains[x] & supported
+        if domain == self.domains[x]:
+            return False
+        self.set_domain(x, domain)
+        return True
+
+
+    def domain(self, var):
+        """
+        Return the list of words in the domain of `var`.
+        """
+        return self.crossword.store.words(var.length, self.domains[var])
+
+
+    def set_domain(self, var, bits):
+        """
+        Replace the domain of `var` by the bitset `bits`, recording the
+        previous one on the trail if search has started.
+        """
+        if bits == self.domains[var]:
+            return
+        if self.trail is not None:
+            self.trail.append((var, self.domains[var]))
+        self.domains[var] = bits
+
+
+    def undo(self, mark):
+        """
+        Restore every domain replaced since the trail had length `mark`.
+        """
+        while len(self.trail) > mark:
+            var, bits = self.trail.pop()
+            self.domains[var] = bits
 
 
     def ac3(self, arcs=None):
@@ -145,24 +218,29 @@ class CrosswordCreator():
         # begin with initial list of all arcs
         if not arcs:
             arcs = [
-                (v1, v2) for (v1, v2), overlap in self.crossword.overlaps.items() 
-                if overlap is not None
+                (x, y) for x in self.crossword.variables
+                for y in self.crossword.neighbors(x)
             ]
-        
+
+        # queue of arcs to revise, and the arcs currently in it
+        queue = deque(arcs)
+        queued = set(queue)
+
         # while there are still arcs to revise
-        while len(arcs) != 0:
+        while queue:
             # dequeue arc and revise
-            x, y = arcs[0]
-            arcs.pop(0)
+            x, y = queue.popleft()
+            queued.discard((x, y))
             if self.revise(x, y):
                 # no valid states
-                if len(self.domains[x]) == 0:
+                if not self.domains[x]:
                     return False
-                # enqueue new arcs
+                # enqueue new arcs, unless already waiting
                 for z in self.crossword.neighbors(x):
-                    if z is not y:
-                        arcs.append((z, x))
-        
+                    if z != y and (z, x) not in queued:
+                        queue.append((z, x))
+                        queued.add((z, x))
+
         return True
 
 
@@ -181,8 +259,8 @@ class CrosswordCreator():
         Return True if `assignment` is consistent (i.e., words fit in crossword
         puzzle without conflicting characters); return False otherwise.
         """
-        # list of words already assigned to variable
-        assigned = []
+        # set of words already assigned to variable
+        assigned = set()
         for v1, word1 in assignment.items():
             # all values are distinct and have the correct length
             if word1 in assigned or len(word1) != v1.length:
@@ -194,7 +272,7 @@ class CrosswordCreator():
                     word2 = assignment[v2]
                     if word1[i] != word2[j]:
                         return False
-            assigned.append(word1)
+            assigned.add(word1)
 
         return True
 
@@ -206,23 +284,39 @@ class CrosswordCreator():
         The first value in the list, for example, should be the one
         that rules out the fewest values among the neighbors of `var`.
         """
-        values = []
-        for word1 in self.domains[var]:
-            # number of values discarded 
-            count = 0
-            # check for unnassigned variables among neighbors
-            for v in self.domains:
-                if v not in assignment and v in self.crossword.neighbors(var):
-                    # count discards
-                    var_index, v_index = self.crossword.overlaps[var, v]
-                    for word2 in self.domains[v]:
-                        if word1[var_index] != word2[v_index]:
-                            count += 1
-            values.append((word1, count))
-
-        values.sort(key=lambda a: a[1])
-
-        return [word for (word, count) in values]
+        # for each unassigned neighbor: the overlapping position in `var`,
+        # the size of its domain and the number of its words by letter at
+        # the overlap, counted from the store's letter bitmaps
+        store = self.crossword.store
+        neighbors = []
+        for v in self.crossword.neighbors(var):
+            if v not in assignment:
+                var_index, v_index = self.crossword.overlaps[var, v]
+                domain = self.domains[v]
+                letters = {
+                    letter: (domain & bits).bit_count()
+                    for letter, bits in store.letters(v.length, v_index).items()
+                }
+                neighbors.append((var_index, domain.bit_count(), letters))
+
+        # number of values discarded: words in each neighbor with another letter
+        def ruled_out(word):
+            return sum(
+                size - letters.get(word[i], 0)
+                for i, size, letters in neighbors
+            )
+
+        # break ties at random
+        def shuffled(word):
+            return (ruled_out(word), self.random.random())
+
+        key = ruled_out if self.random is None else shuffled
+        words = self.domain(var)
+        if self.order_limit is not None and self.order_limit < len(words):
+            best = heapq.nsmallest(self.order_limit, words, key=key)
+            chosen = set(best)
+            return best + [word for word in words if word not in chosen]
+        return sorted(words, key=key)
 
 
     def select_unassigned_variable(self, assignment):
@@ -233,24 +327,18 @@ class CrosswordCreator():
         degree. If there is a tie, any of the tied variables are acceptable
         return values.
         """
-        # register chosen variable and corresponding number of values
-        values = []
-        for v in self.domains:
-            if v not in assignment:
-                values.append((v, len(self.domains[v])))
-        values.sort(key=lambda a: a[1])
+        # fewest remaining values first, then most neighbors
+        unassigned = [v for v in self.domains if v not in assignment]
+        def key(v):
+            return (self.domains[v].bit_count(), -len(self.crossword.neighbors(v)))
 
-        # check for ties
-        unnassigned = values[0][0]
-        for (v, count) in values:
-            if v == unnassigned:
-                continue
-            if values[0][1] == count:
-                # find variable with most neighbors
-                if self.crossword.neighbors(v) > self.crossword.neighbors(unnassigned):
-                    unnassigned = v
+        best = min(unassigned, key=key)
+        if self.random is None:
+            return best
 
-        return unnassigned
+        # break ties at random
+        ties = [v for v in unassigned if key(v) == key(best)]
+        return self.random.choice(ties)
 
 
     def backtrack(self, assignment):
@@ -272,32 +360,205 @@ class CrosswordCreator():
         # get consistent value
         for word in self.order_domain_values(v, assignment):
             assignment[v] = word
+            self.statistics["nodes"] += 1
             # consistent
             if self.consistent(assignment):
                 result = self.backtrack(assignment)
                 if result is not None:
                     return result
-                # not consistent
-                assignment.pop(v)
+            # not consistent
+            assignment.pop(v)
+            self.statistics["backtracks"] += 1
         
         return None
 
 
+    def backtrack_mac(self, assignment, words):
+        """
+        Backtracking Search maintaining arc consistency: after each
+        assignment, the domains of unassigned variables are pruned with
+        AC-3, and the removals are undone from the trail on backtrack.
+
+        `words` is the set of words in `assignment`, kept alongside it.
+        Return a complete assignment, or None if there is none.
+        """
+        # assignment complete
+        if self.assignment_complete(assignment):
+            return assignment
+
+        # get unnassigned variable
+        v = self.select_unassigned_variable(assignment)
+
+        for word in self.order_domain_values(v, assignment):
+            if not self.consistent_value(v, word, assignment, words):
+                continue
+            mark = len(self.trail)
+            assignment[v] = word
+            self.statistics["nodes"] += 1
+            words.add(word)
+            if self.infer(v, word, assignment):
+                result = self.backtrack_mac(assignment, words)
+                if result is not None:
+                    return result
+            # undo assignment and inferences
+            assignment.pop(v)
+            self.statistics["backtracks"] += 1
+            words.discard(word)
+            self.undo(mark)
+
+            # give up if this search ran out of failures or time
+            self.failures += 1
+            if self.fail_limit is not None and self.failures > self.fail_limit:
+                raise Restart()
+            if self.deadline is not None and time.time() > self.deadline:
+                raise Restart()
+
+        return None
+
+
+    def solve_restarts(self, seed, unit=RESTART_UNIT, deadline=None):
+        """
+        Solve the CSP with randomized tie-breaking, maintaining arc
+        consistency and restarting the search after `unit` times the
+        next number of the Luby sequence (1, 1, 2, 1, 1, 2, 4, ...) of
+        failures, until `deadline` (in time.time() seconds), if any.
+
+        Return a tuple (finished, assignment): `finished` is False if the
+        deadline passed first, and `assignment` is None if there is none.
+        """
+        self.enforce_node_consistency()
+        if not self.ac3():
+            return True, None
+        self.trail = []
+        self.random = random.Random(seed)
+        self.deadline = deadline
+
+        restart = 1
+        while True:
+            self.failures = 0
+            self.fail_limit = unit * luby(restart)
+            try:
+                return True, self.backtrack_mac(dict(), set())
+            except Restart:
+                self.undo(0)
+                if deadline is not None and time.time() > deadline:
+                    return False, None
+            restart += 1
+
+
+    def consistent_value(self, var, word, assignment, words):
+        """
+        Return True if assigning `word` to `var` is consistent with the
+        rest of `assignment`, whose words are `words`; only the constraints
+        involving `var` are checked.
+        """
+        if word in words or len(word) != var.length:
+            return False
+        for v in self.crossword.neighbors(var):
+            if v in assignment:
+                i, j = self.crossword.overlaps[var, v]
+                if word[i] != assignment[v][j]:
+                    return False
+        return True
+
+
+    def infer(self, var, word, assignment):
+        """
+        Reduce the domain of `var` to `word`, remove `word` from the domains
+        of the other unassigned variables, and restore arc consistency
+        around every domain that changed.
+
+        Return False if some domain ends up empty, True otherwise.
+        """
+        bit = self.crossword.store.match(word)
+        self.set_domain(var, bit)
+
+        # words are distinct
+        changed = [var]
+        for v in self.domains:
+            if v not in assignment and v.length == var.length and self.domains[v] & bit:
+                self.set_domain(v, self.domains[v] & ~bit)
+                if not self.domains[v]:
+                    return False
+                changed.append(v)
+
+        arcs = [
+            (z, v) for v in changed for z in self.crossword.neighbors(v)
+            if z not in assignment
+        ]
+        return not arcs or self.ac3(arcs)
+
+
+def luby(i):
+    """
+    Return the `i`th number of the Luby sequence, starting from 1.
+    """
+    k = 1
+    while (1 << k) - 1 < i:
+        k += 1
+    if (1 << k) - 1 == i:
+        return 1 << (k - 1)
+    return luby(i - (1 << (k - 1)) + 1)
+
+
+def solve_portfolio(structure, words, seconds, workers=None):
+    """
+    Solve the crossword given by the `structure` and `words` files with
+    a portfolio of differently seeded and configured restarting searches,
+    run by `workers` processes for at most `seconds` seconds. The first
+    search to finish wins and the others are terminated.
+
+    Return a tuple (finished, assignment) as in solve_restarts.
+    """
+    workers = workers or os.cpu_count()
+    deadline = time.time() + seconds
+    jobs = [(structure, words, seed, deadline) for seed in range(workers)]
+    with multiprocessing.Pool(workers) as pool:
+        results = pool.imap_unordered(portfolio_search, jobs)
+        try:
+            return results.next(timeout=max(deadline - time.time(), 0) + 1)
+        except multiprocessing.TimeoutError:
+            return False, None
+
+
+def portfolio_search(job):
+    """
+    Run one search of solve_portfolio. Even seeds restart quickly, odd
+    seeds wait longer and only sort the best values of large domains.
+    """
+    structure, words, seed, deadline = job
+    creator = CrosswordCreator(Crossword(structure, words))
+    if seed % 2:
+        creator.order_limit = 50
+        return creator.solve_restarts(seed, unit=RESTART_UNIT * 10, deadline=deadline)
+    return creator.solve_restarts(seed, deadline=deadline)
+
+
 def main():
 
-    # Check usage
-    if len(sys.argv) not in [3, 4]:
-        sys.exit("Usage: python generate.py structure words [output]")
+    # Check usage, with an optional wall-clock budget at the end
+    args = sys.argv[1:]
+    seconds = None
+    if len(args) >= 2 and args[-2] == "--seconds":
+        seconds = float(args[-1])
+        args = args[:-2]
+    if len(args) not in [2, 3]:
+        sys.exit("Usage: python generate.py structure words [output] [--seconds budget]")
 
     # Parse command-line arguments
-    structure = sys.argv[1]
-    words = sys.argv[2]
-    output = sys.argv[3] if len(sys.argv) == 4 else None
+    structure = args[0]
+    words = args[1]
+    output = args[2] if len(args) == 3 else None
 
-    # Generate crossword
+    # Generate crossword, with a portfolio of searches if given a budget
     crossword = Crossword(structure, words)
     creator = CrosswordCreator(crossword)
-    assignment = creator.solve()
+    if seconds is None:
+        assignment = creator.solve()
+    else:
+        finished, assignment = solve_portfolio(structure, words, seconds)
+        if not finished:
+            sys.exit("No solution found in time.")
 
     # Print result
     if assignment is None:
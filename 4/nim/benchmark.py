@@ -0,0 +1,126 @@
+import itertools
+import math
+import os
+import random
+import sys
+import time
+
+from nim import NimAI, optimal_action, self_play, train, train_parallel
+
+# Initial piles to train on, and games to play on each
+CONFIGURATIONS = [[1, 3, 5, 7], [1, 3, 5, 7, 9], [2, 3, 4, 5, 6, 7]]
+GAMES = 100000
+
+# Initial piles and numbers of games to compare with optimal play on,
+# and winning positions to sample from larger configurations
+ORACLE_CONFIGURATIONS = [
+    [1, 3, 5, 7, 9, 11], [1, 3, 5, 7, 9, 11, 13], [1, 3, 5, 7, 9, 11, 13, 15]
+]
+ORACLE_GAMES = [10000, 30000, 100000, 300000, 1000000]
+POSITIONS = 10000
+
+
+def main():
+    if len(sys.argv) == 2 and sys.argv[1] == "--oracle":
+        return compare_oracle()
+    if len(sys.argv) > 2:
+        sys.exit("Usage: python benchmark.py [games | --oracle]")
+    games = int(sys.argv[1]) if len(sys.argv) == 2 else GAMES
+
+    counts = [1]
+    while counts[-1] * 2 <= os.cpu_count():
+        counts.append(counts[-1] * 2)
+
+    print(f"{'piles':<22}{'processes':>10}{'time':>10}{'games/s':>10}{'speedup':>9}{'optimal':>9}")
+    for initial in CONFIGURATIONS:
+        ai, serial = measure(train, games, initial)
+        report(initial, "serial", serial, games, 1, ai)
+        for processes in counts:
+            ai, elapsed = measure(train_parallel, games, processes, initial=initial)
+            report(initial, processes, elapsed, games, serial / elapsed, ai)
+
+
+def measure(function, *args, **kwargs):
+    """
+    Call `function` with `args` and `kwargs` without printing progress,
+    and return a tuple with its result and the time it took in seconds.
+    """
+    with open(os.devnull, "w") as devnull:
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            start = time.perf_counter()
+            result = function(*args, **kwargs)
+            return result, time.perf_counter() - start
+        finally:
+            sys.stdout = stdout
+
+
+def report(initial, processes, elapsed, games, speedup, ai):
+    """
+    Print one line of the results table.
+    """
+    print(f"{str(initial):<22}{processes:>10}{elapsed:>9.2f}s{games / elapsed:>10.0f}"
+          f"{speedup:>8.2f}x{optimal_share(ai, initial):>9.1%}")
+
+
+def compare_oracle():
+    """
+    Print, for every configuration of ORACLE_CONFIGURATIONS, how often
+    the AI trained by `train` plays optimally after each number of games
+    of ORACLE_GAMES, with and without sharing Q-values between
+    permutations of the piles, as well as the training time and the
+    size of the Q-learning table.
+    """
+    print(f"{'piles':<34}{'games':>9}{'states':>10}{'time':>9}{'optimal':>9}  canonical")
+    for initial in ORACLE_CONFIGURATIONS:
+        positions = winning_positions(initial)
+        for canonical in [False, True]:
+            # keep training the same AI up to each number of games
+            ai = NimAI(canonical=canonical)
+            played, elapsed = 0, 0
+            for games in ORACLE_GAMES:
+                _, seconds = measure(self_play, ai, games - played, initial, progress=False)
+                played, elapsed = games, elapsed + seconds
+                print(f"{str(initial):<34}{games:>9}{len(ai.q):>10}{elapsed:>8.2f}s"
+                      f"{optimal_share(ai, initial, positions):>9.1%}  {canonical}")
+
+
+def winning_positions(initial, count=POSITIONS, seed=0):
+    """
+    Return the states within the piles `initial` from which the player
+    to move can force a win: all of them if there are at most 10 times
+    `count` states, or `count` of them at random.
+    """
+    if math.prod(pile + 1 for pile in initial) <= count * 10:
+        return [
+            list(state)
+            for state in itertools.product(*(range(pile + 1) for pile in initial))
+            if optimal_action(list(state)) is not None
+        ]
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        state = [rng.randint(0, pile) for pile in initial]
+        if optimal_action(state) is not None:
+            positions.append(state)
+    return positions
+
+
+def optimal_share(ai, initial, positions=None):
+    """
+    Return the share of winning `positions` (by default all those within
+    the piles `initial`) in which the greedy action of `ai` is optimal,
+    leaving the other player no way to win.
+    """
+    positions = positions or winning_positions(initial)
+    optimal = 0
+    for state in positions:
+        i, j = ai.choose_action(state, epsilon=False)
+        after = state.copy()
+        after[i] -= j
+        optimal += any(after) and optimal_action(after) is None
+    return optimal / len(positions)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,24 @@
 import math
+import mmap
+import multiprocessing
+import numpy
+import os
 import random
+import struct
 import time
 
+# Seconds between progress reports
+PROGRESS = 1
+
+# Rounds of training after which train_parallel merges the workers' tables
+ROUNDS = 10
+
+# Q-learning table files start with this magic and version, in a header
+# of this size
+TABLE_MAGIC = b"NIMQ"
+TABLE_VERSION = 2
+TABLE_HEADER = 64
+
 
 class Nim():
 
@@ -72,19 +89,51 @@ class Nim():
 
 class NimAI():
 
-    def __init__(self, alpha=0.5, epsilon=0.1):
+    def __init__(self, alpha=0.5, epsilon=0.1, canonical=False):
         """
-        Initialize AI with an empty Q-learning dictionary,
+        Initialize AI with an empty Q-learning table,
         an alpha (learning) rate, and an epsilon rate.
 
-        The Q-learning dictionary maps `(state, action)`
-        pairs to a Q-value (a number).
-         - `state` is a tuple of remaining piles, e.g. (1, 1, 4, 4)
+        If `canonical` is true, states that are permutations of each
+        other share their Q-values: the table only holds states with
+        piles in increasing order (see `canonical_state`), and actions
+        are moved to the matching pile.
+
+        The Q-learning table maps the code of a state (see `state_code`)
+        to a pair `(actions, values)`, where `actions` is the list of
+        actions available in that state, in the order of `action_index`,
+        and `values` is a list with the Q-value of each action.
+         - `state` is a list or tuple of remaining piles, e.g. (1, 1, 4, 4)
          - `action` is a tuple `(i, j)` for an action
         """
         self.q = dict()
         self.alpha = alpha
         self.epsilon = epsilon
+        self.canonical = canonical
+
+    def key(self, state, action=None):
+        """
+        Return a tuple `(state, action)` with `state` and `action` as
+        they are kept in the Q-learning table.
+        """
+        if not self.canonical:
+            return state, action
+        if action is None:
+            return sorted(state), None
+        state, order = canonical_state(state)
+        return state, (order.index(action[0]), action[1])
+
+    def q_entry(self, state):
+        """
+        Return the `(actions, values)` pair of `state` in the Q-learning
+        table, adding it with Q-values of 0 if it is not there yet.
+        """
+        code = state_code(state)
+        entry = self.q.get(code)
+        if entry is None:
+            actions = [(i, j) for i, pile in enumerate(state) for j in range(1, pile + 1)]
+            entry = self.q[code] = (actions, [0.0] * len(actions))
+        return entry
 
     def update(self, old_state, action, new_state, reward):
         """
@@ -92,16 +141,44 @@ class NimAI():
         in that state, a new resulting state, and the reward received
         from taking that action.
         """
-        old = self.get_q_value(old_state, action)
+        old_state, action = self.key(old_state, action)
+        self.q_entry(old_state)
         best_future = self.best_future_reward(new_state)
-        self.update_q_value(old_state, action, old, reward, best_future)
+        self.learn(state_code(old_state), action_index(old_state, action), reward, best_future)
+
+    def lookup(self, state):
+        """
+        Return a tuple `(code, actions, values, order)` for `state`: the
+        code of the state as kept in the Q-learning table, its actions
+        and their Q-values (added as 0 if it is not there yet), and the
+        `order` of `canonical_state` if the AI is canonical, else None.
+        """
+        order = None
+        if self.canonical:
+            state, order = canonical_state(state)
+        code = state_code(state)
+        entry = self.q.get(code)
+        if entry is None:
+            entry = self.q_entry(state)
+        return code, entry[0], entry[1], order
+
+    def learn(self, code, index, reward, best_future):
+        """
+        Move the Q-value of the action at `index` in the state with
+        `code` towards `reward` plus the estimate of future rewards
+        `best_future`, by the learning rate.
+        """
+        values = self.q[code][1]
+        values[index] += self.alpha * (reward + best_future - values[index])
 
     def get_q_value(self, state, action):
         """
         Return the Q-value for the state `state` and the action `action`.
         If no Q-value exists yet in `self.q`, return 0.
         """
-        return self.q[tuple(state), action] if (tuple(state), action) in self.q.keys() else 0
+        state, action = self.key(state, action)
+        actions, values = self.q_entry(state)
+        return float(values[action_index(state, action)])
 
     def update_q_value(self, state, action, old_q, reward, future_rewards):
         """
@@ -119,7 +196,9 @@ class NimAI():
         is the sum of the current reward and estimated future rewards.
         """
         new_q = reward + future_rewards
-        self.q[tuple(state), action] = old_q + self.alpha * (new_q - old_q)
+        state, action = self.key(state, action)
+        actions, values = self.q_entry(state)
+        values[action_index(state, action)] = old_q + self.alpha * (new_q - old_q)
 
     def best_future_reward(self, state):
         """
@@ -130,12 +209,14 @@ class NimAI():
         Use 0 as the Q-value if a `(state, action)` pair has no
         Q-value in `self.q`. If there are no available actions in
         `state`, return 0.
+
+        The maximum is not clamped at 0: once every action from `state`
+        is known to lose, the state is worth less than an unexplored one,
+        and that value is what the previous move should learn from.
         """
-        best = 0
-        for action in Nim.available_actions(state):
-            if (tuple(state), action) in self.q.keys() and self.q[tuple(state), action] > best:
-                best = self.q[tuple(state), action]
-        return best
+        state, _ = self.key(state)
+        actions, values = self.q_entry(state)
+        return max(values) if values else 0
 
     def choose_action(self, state, epsilon=True):
         """
@@ -152,75 +233,446 @@ class NimAI():
         If multiple actions have the same Q-value, any of those
         options is an acceptable return value.
         """
-        # get best action
-        best_q = 0
-        best_action = None
-        for action in list(Nim.available_actions(state)):
-            if (tuple(state), action) in self.q.keys() and self.q[tuple(state), action] >= best_q:
-                best_q = self.q[tuple(state), action]
-                best_action = action
+        order = None
+        if self.canonical:
+            state, order = canonical_state(state)
+        actions, values = self.q_entry(state)
+
+        # choose randomly among all actions (P=epsilon)
+        if epsilon and random.random() < self.epsilon:
+            action = random.choice(actions)
 
-        if not epsilon:
-            return best_action
+        # or the best action (P=1-epsilon)
         else:
-            all_actions = list(Nim.available_actions(state))
-            # choose either best action (P=epsilon) or all actions (P=1-epsilon)
-            choice = random.choices(['best', 'other'], weights=(1-self.epsilon, self.epsilon), k=1)
-            # return best action or choose randomly among all actions
-            return best_action if choice == 'best' else random.choice(all_actions)
+            action = actions[values.index(max(values))]
+
+        # move the action back to its pile in `state`
+        return action if order is None else (order[action[0]], action[1])
+
+
+class CountingNimAI(NimAI):
+    """
+    A NimAI that also counts the updates of each state and action, in
+    `self.visits`, mapping the code of a state to a list of counts in
+    the order of its actions.
+    """
+
+    def __init__(self, alpha=0.5, epsilon=0.1, canonical=False):
+        super().__init__(alpha, epsilon, canonical)
+        self.visits = dict()
+
+    def learn(self, code, index, reward, best_future):
+        super().learn(code, index, reward, best_future)
+        if code not in self.visits:
+            self.visits[code] = [0] * len(self.q[code][0])
+        self.visits[code][index] += 1
+
+
+class NimSumAI():
+
+    def choose_action(self, state, epsilon=True):
+        """
+        Given a state `state`, return the action `(i, j)` of optimal
+        play (see `optimal_action`), or take one object from the largest
+        pile if every action loses. `epsilon` is ignored.
+        """
+        action = optimal_action(state)
+        if action is None:
+            i = max(range(len(state)), key=lambda i: state[i])
+            action = (i, 1)
+        return action
+
+
+def nim_sum(state):
+    """
+    Return the nim-sum of `state`: the bitwise exclusive or of its piles.
+    """
+    result = 0
+    for pile in state:
+        result ^= pile
+    return result
+
+
+def optimal_action(state):
+    """
+    Return an action `(i, j)` with which the player to move in `state`
+    wins against any play, or None if there is none.
+
+    The player who takes the last object loses, so optimal play leaves
+    a nim-sum of 0 while two or more piles have more than one object,
+    and otherwise leaves an odd number of piles of one object.
+    """
+    large = [i for i, pile in enumerate(state) if pile > 1]
+    ones = sum(pile == 1 for pile in state)
+    if len(large) == 0:
+        return (state.index(1), 1) if ones % 2 == 0 and ones > 0 else None
+    if len(large) == 1:
+        i = large[0]
+        return (i, state[i] - (ones % 2 == 0))
+
+    total = nim_sum(state)
+    if total == 0:
+        return None
+    for i, pile in enumerate(state):
+        if pile ^ total < pile:
+            return (i, pile - (pile ^ total))
+
+
+def canonical_state(state):
+    """
+    Return a tuple `(piles, order)`, where `piles` lists the piles of
+    `state` in increasing order and `order[k]` is the pile of `state`
+    that became pile `k`.
+    """
+    order = sorted(range(len(state)), key=state.__getitem__)
+    return [state[i] for i in order], order
+
+
+def canonical_states(bounds):
+    """
+    Return an array with a row for each state whose piles are in
+    increasing order and hold at most `bounds` objects, which must be
+    in increasing order too.
+    """
+    states = numpy.zeros((1, 0), dtype=int)
+    low = numpy.zeros(1, dtype=int)
+    for bound in bounds:
+        counts = bound - low + 1
+        parents = numpy.repeat(numpy.arange(len(states)), counts)
+        starts = numpy.cumsum(counts) - counts
+        piles = low[parents] + numpy.arange(counts.sum()) - starts[parents]
+        states = numpy.column_stack((states[parents], piles))
+        low = piles
+    return states
+
+
+def state_code(state):
+    """
+    Return an integer packing the piles of `state`, one byte per pile
+    (so piles may hold up to 255 objects).
+    """
+    return int.from_bytes(bytes(state), "little")
+
+
+def decode_state(code, piles):
+    """
+    Return the `piles` piles of the state with `code`, as a list.
+    """
+    return list(code.to_bytes(piles, "little"))
+
+
+def action_index(state, action):
+    """
+    Return the position of `action` among the actions available in
+    `state`: actions are ordered by pile, then by number of objects.
+    """
+    i, j = action
+    return sum(state[:i]) + j - 1
+
+
+def dense_layout(bounds):
+    """
+    Return the layout of a dense Q-value array for states whose piles
+    hold at most `bounds` objects, as a tuple (radix, pile_of, count_of):
+    the row of `state` is `state @ radix` (mixed radix over the piles,
+    a perfect hash of the states), and column `a` holds the action of
+    removing `count_of[a]` objects from pile `pile_of[a]`.
+    """
+    bounds = numpy.asarray(bounds)
+    radix = numpy.cumprod(numpy.concatenate(([1], bounds[:-1] + 1)))
+    pile_of = numpy.repeat(numpy.arange(len(bounds)), bounds)
+    count_of = numpy.concatenate([numpy.arange(1, pile + 1) for pile in bounds])
+    return radix, pile_of, count_of
+
+
+def save_table(ai, path, dtype="float32"):
+    """
+    Write the Q-learning table of `ai` to the file at `path` as a dense
+    array of `dtype` values (float16 halves the size of float32), with
+    a row for every state within the largest piles of the table (only
+    for states with piles in increasing order if `ai` is canonical) and
+    a column for every action, after a header of TABLE_HEADER bytes.
+    """
+    if len(ai.q) == 0:
+        raise ValueError("Q-learning table is empty")
+    piles = max((code.bit_length() + 7) // 8 for code in ai.q)
+    states = {code: decode_state(code, piles) for code in ai.q}
+    bounds = numpy.zeros(piles, dtype=int)
+    for state in states.values():
+        numpy.maximum(bounds, state, out=bounds)
+
+    radix, pile_of, count_of = dense_layout(bounds)
+    rows = table_rows(bounds, ai.canonical)
+    offsets = numpy.concatenate(([0], numpy.cumsum(bounds)))
+    table = numpy.zeros((len(rows), len(pile_of)), dtype=dtype)
+    for code, (actions, values) in ai.q.items():
+        columns = [offsets[i] + j - 1 for i, j in actions]
+        table[numpy.searchsorted(rows, numpy.dot(states[code], radix)), columns] = values
+
+    header = struct.pack(
+        f"<4sBc?B{piles}B", TABLE_MAGIC, TABLE_VERSION, table.dtype.char.encode(),
+        ai.canonical, piles, *bounds
+    )
+    with open(path, "wb") as f:
+        f.write(header.ljust(TABLE_HEADER, b"\0"))
+        f.write(table.tobytes())
+
+
+def load_table(path, alpha=0.5, epsilon=0.1):
+    """
+    Return a NimAI whose Q-learning table is read from a file written by
+    save_table, mapped into memory rather than read: the values of a
+    state are only read when the AI first looks at it, and processes
+    that load the same file share its pages.
+    """
+    table = MappedTable(path)
+    ai = NimAI(alpha, epsilon, table.canonical)
+    ai.q = table
+    return ai
+
+
+def canonical_counts(bounds):
+    """
+    Return a list where `counts[k][v]` is the number of ways to fill the
+    first `k` piles of a state within `bounds` in increasing order with
+    at most `v` objects each, for every `v` up to the last bound.
+    """
+    counts = [[1] * (bounds[-1] + 1)]
+    for bound in bounds:
+        total, row = 0, []
+        for v in range(bounds[-1] + 1):
+            if v <= bound:
+                total += counts[-1][v]
+            row.append(total)
+        counts.append(row)
+    return counts
+
+
+def canonical_row(state, counts):
+    """
+    Return the position of the state with piles in increasing order
+    `state` among all such states within the bounds of `counts` (see
+    `canonical_counts`), sorted by mixed-radix number: the number of
+    those states that are equal in the last piles and smaller in the
+    first pile that differs.
+    """
+    row = 0
+    for k, pile in enumerate(state):
+        if pile:
+            row += counts[k + 1][pile - 1]
+    return row
+
+
+def table_rows(bounds, canonical):
+    """
+    Return the sorted array of mixed-radix numbers (see `dense_layout`)
+    of the states that have a row in a table saved by save_table, which
+    is every state within `bounds`, or only the canonical ones.
+    """
+    if canonical:
+        radix, _, _ = dense_layout(bounds)
+        return numpy.sort(canonical_states(bounds) @ radix)
+    return numpy.arange(int(numpy.prod(numpy.asarray(bounds) + 1)))
+
+
+class MappedTable():
+
+    def __init__(self, path):
+        """
+        Map the Q-learning table in the file at `path`, written by
+        save_table. Entries read from it, or added, are kept in `self.q`,
+        so the file itself is never written.
+        """
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, dtype, canonical, piles = struct.unpack_from("<4sBc?B", self.map)
+        if magic != TABLE_MAGIC or version != TABLE_VERSION:
+            raise ValueError(f"{path} is not a Q-learning table")
+        self.canonical = canonical
+        self.bounds = struct.unpack_from(f"<{piles}B", self.map, 8)
+        radix, pile_of, _ = dense_layout(self.bounds)
+        self.radix = radix.tolist()
+        self.counts = canonical_counts(self.bounds) if canonical else None
+        self.offsets = [0] + numpy.cumsum(self.bounds).tolist()
+        self.table = numpy.frombuffer(
+            self.map, dtype=dtype.decode(), offset=TABLE_HEADER
+        ).reshape(-1, len(pile_of))
+        self.q = dict()
+
+    def get(self, code, default=None):
+        """
+        Return the `(actions, values)` pair of the state with `code`, or
+        `default` if the table has no row for it.
+        """
+        entry = self.q.get(code)
+        if entry is None:
+            entry = self.read(code)
+            if entry is None:
+                return default
+            self.q[code] = entry
+        return entry
+
+    def row(self, code):
+        """
+        Return the row of the state with `code` in the mapped table, or
+        None if it has none.
+        """
+        if code >> 8 * len(self.bounds):
+            return None
+        state = decode_state(code, len(self.bounds))
+        if any(pile > bound for pile, bound in zip(state, self.bounds)):
+            return None
+        if self.counts is None:
+            return sum(p * r for p, r in zip(state, self.radix))
+        if any(a > b for a, b in zip(state, state[1:])):
+            return None
+        return canonical_row(state, self.counts)
+
+    def read(self, code):
+        """
+        Return the `(actions, values)` pair of the state with `code` as
+        stored in the mapped table, or None if it has no row for it.
+        """
+        row = self.row(code)
+        if row is None:
+            return None
+        state = decode_state(code, len(self.bounds))
+        actions = [(i, j) for i, pile in enumerate(state) for j in range(1, pile + 1)]
+        columns = [self.offsets[i] + j - 1 for i, j in actions]
+        return (actions, self.table[row, columns].tolist())
+
+    def codes(self):
+        """
+        Return the list of codes of the states with a row in the mapped
+        table.
+        """
+        bounds = numpy.array(self.bounds, dtype=numpy.uint64)
+        rows = table_rows(self.bounds, self.canonical)
+        states = rows.astype(numpy.uint64)[:, None] // numpy.array(self.radix, dtype=numpy.uint64) % (bounds + 1)
+        shifts = numpy.arange(len(bounds), dtype=numpy.uint64) * numpy.uint64(8)
+        return (states << shifts).sum(axis=1, dtype=numpy.uint64).tolist()
+
+    def __iter__(self):
+        """Iterate over the codes of the mapped states, then of added ones."""
+        yield from self.codes()
+        for code in self.q:
+            if self.row(code) is None:
+                yield code
+
+    def items(self):
+        """
+        Iterate over pairs `(code, (actions, values))` of every state,
+        without keeping the entries read from the mapped table.
+        """
+        for code in self:
+            entry = self.q.get(code)
+            yield code, self.read(code) if entry is None else entry
 
-def train(n):
+    def __getitem__(self, code):
+        entry = self.get(code)
+        if entry is None:
+            raise KeyError(code)
+        return entry
+
+    def __setitem__(self, code, entry):
+        self.q[code] = entry
+
+    def __contains__(self, code):
+        return code in self.q or self.row(code) is not None
+
+    def __len__(self):
+        return len(self.table) + sum(self.row(code) is None for code in self.q)
+
+
+def train(n, initial=[1, 3, 5, 7], canonical=False):
     """
     Train an AI by playing `n` games against itself.
+    If `canonical` is true, the AI shares Q-values between permutations
+    of the piles.
     """
+    player = NimAI(canonical=canonical)
+    self_play(player, n, initial)
+    print("Done training")
+
+    # Return the trained AI
+    return player
 
-    player = NimAI()
+
+def self_play(player, n, initial=[1, 3, 5, 7], progress=True):
+    """
+    Have `player` learn from `n` games against itself, starting from
+    the piles `initial`, printing progress at most every PROGRESS
+    seconds if `progress` is true.
+    """
+    report = time.time() + PROGRESS
 
     # Play n games
     for i in range(n):
-        print(f"Playing training game {i + 1}")
-        game = Nim()
+        if progress and time.time() >= report:
+            print(f"Playing training game {i + 1} of {n}")
+            report = time.time() + PROGRESS
+        piles = list(initial)
+        turn = 0
 
-        # Keep track of last move made by either player
-        last = {
-            0: {"state": None, "action": None},
-            1: {"state": None, "action": None}
-        }
+        # Keep track of last move made by either player, as the code of
+        # its state and the index of its action
+        last = [None, None]
 
         # Game loop
         while True:
 
-            # Keep track of current state and action
-            state = game.piles.copy()
-            action = player.choose_action(game.piles)
+            # The last move of the player to move gets no reward yet,
+            # and the estimate of future rewards of the current state
+            code, actions, values, order = player.lookup(piles)
+            best = max(values)
+            if last[turn] is not None:
+                player.learn(*last[turn], 0, best)
 
-            # Keep track of last state and action
-            last[game.player]["state"] = state
-            last[game.player]["action"] = action
+            # Choose a random action (P=epsilon) or the best one
+            if random.random() < player.epsilon:
+                index = random.randrange(len(actions))
+            else:
+                index = values.index(best)
+            last[turn] = (code, index)
 
             # Make move
-            game.move(action)
-            new_state = game.piles.copy()
+            pile, count = actions[index]
+            piles[pile if order is None else order[pile]] -= count
+            turn = 1 - turn
 
             # When game is over, update Q values with rewards
-            if game.winner is not None:
-                player.update(state, action, new_state, -1)
-                player.update(
-                    last[game.player]["state"],
-                    last[game.player]["action"],
-                    new_state,
-                    1
-                )
+            if not any(piles):
+                player.learn(code, index, -1, 0)
+                if last[turn] is not None:
+                    player.learn(*last[turn], 1, 0)
                 break
 
-            # If game is continuing, no rewards yet
-            elif last[game.player]["state"] is not None:
-                player.update(
-                    last[game.player]["state"],
-                    last[game.player]["action"],
-                    new_state,
-                    0
-                )
+
+def train_parallel(n, processes=None, rounds=ROUNDS, initial=[1, 3, 5, 7],
+                   canonical=False):
+    """
+    Train an AI by playing `n` games against itself, split among
+    `processes` workers that each learn on their own copy of the
+    Q-learning table.
+
+    After each of `rounds` rounds, the workers' tables are merged into
+    the master table, where the Q-value of each state and action is the
+    average of the workers' values weighted by how many times each
+    worker updated it in that round (values nobody updated are kept),
+    and the merged table is sent back to the workers for the next round.
+    """
+    processes = processes or os.cpu_count()
+    player = NimAI(canonical=canonical)
+    jobs = processes * rounds
+    games = [n * (k + 1) // jobs - n * k // jobs for k in range(jobs)]
+    with multiprocessing.Pool(processes) as pool:
+        for r in range(rounds):
+            shares = [
+                (player.q, games[k], initial, canonical, k)
+                for k in range(r * processes, (r + 1) * processes)
+            ]
+            merge_tables(player.q, pool.map(parallel_self_play, shares))
+            print(f"Played {sum(games[:(r + 1) * processes])} of {n} training games")
 
     print("Done training")
 
@@ -228,6 +680,49 @@ def train(n):
     return player
 
 
+def parallel_self_play(job):
+    """
+    Play the games of one worker of train_parallel, starting from the
+    master table. Return a dictionary mapping the code of each state
+    the worker updated to a tuple `(actions, values, visits)`, with its
+    actions, their new Q-values and how many times each was updated.
+    """
+    q, n, initial, canonical, seed = job
+    random.seed(seed)
+    player = CountingNimAI(canonical=canonical)
+    player.q = q
+    self_play(player, n, initial, progress=False)
+    return {
+        code: (*player.q[code], visits)
+        for code, visits in player.visits.items()
+    }
+
+
+def merge_tables(q, tables):
+    """
+    Merge the worker `tables` returned by parallel_self_play into the
+    Q-learning table `q`, averaging the values of each action weighted
+    by its number of updates.
+    """
+    merged = dict()
+    for table in tables:
+        for code, (actions, values, visits) in table.items():
+            if code not in merged:
+                merged[code] = (actions, [0.0] * len(values), [0] * len(values))
+            actions, totals, counts = merged[code]
+            for i, (value, count) in enumerate(zip(values, visits)):
+                totals[i] += value * count
+                counts[i] += count
+
+    for code, (actions, totals, counts) in merged.items():
+        if code not in q:
+            q[code] = (actions, [0.0] * len(actions))
+        values = q[code][1]
+        for i, (total, count) in enumerate(zip(totals, counts)):
+            if count:
+                values[i] = total / count
+
+
 def play(ai, human_player=None):
     """
     Play human game against the AI.
@@ -1,4 +1,16 @@
-from nim import train, play
+import os
+import sys
 
-ai = train(1000)
+from nim import train, play, save_table, load_table
+
+if len(sys.argv) > 2:
+    sys.exit("Usage: python play.py [table]")
+
+# Reuse a saved Q-learning table if given one, or train and save it
+if len(sys.argv) == 2 and os.path.exists(sys.argv[1]):
+    ai = load_table(sys.argv[1])
+else:
+    ai = train(1000)
+    if len(sys.argv) == 2:
+        save_table(ai, sys.argv[1])
 play(ai)
@@ -0,0 +1,111 @@
+import numpy
+import os
+import sys
+import time
+
+from sklearn.model_selection import train_test_split
+from sklearn.neighbors import NearestNeighbors
+from sklearn.preprocessing import StandardScaler
+
+from shopping import NEIGHBORS, TEST_SIZE, evaluate, load_data, train_model
+
+# Test rows used as queries, numbers of lists probed by the IVF index,
+# and relative size of the noise added to copies of the training data
+QUERIES = 2000
+PROBES = [1, 2, 4, 8, 16, 32, 64]
+NOISE = 0.01
+
+
+def main():
+    if len(sys.argv) not in [2, 3]:
+        sys.exit("Usage: python benchmark.py data [copies]")
+    copies = int(sys.argv[2]) if len(sys.argv) == 3 else 1
+
+    evidence, labels = load_data(sys.argv[1])
+    X_train, X_test, y_train, y_test = train_test_split(
+        evidence, labels, test_size=TEST_SIZE, random_state=0
+    )
+    X_train, y_train = enlarge(X_train, y_train, copies)
+    X_test, y_test = X_test[:QUERIES], y_test[:QUERIES]
+    print(f"{len(X_train)} training rows, {len(X_test)} queries, k={NEIGHBORS}")
+
+    # exact neighbors and predictions to compare with
+    scaler = StandardScaler().fit(X_train)
+    exact = NearestNeighbors(n_neighbors=NEIGHBORS, algorithm="brute").fit(scaler.transform(X_train))
+    truth = exact.kneighbors(scaler.transform(X_test), return_distance=False)
+    reference = None
+
+    print(f"{'backend':<16}{'fit':>9}{'queries/s':>11}{'recall':>8}{'agreement':>11}"
+          f"{'sensitivity':>13}{'specificity':>13}")
+    for backend in ["brute", "kd_tree", "ball_tree"]:
+        model, fit = timed(train_model, X_train, y_train, backend)
+        predictions, elapsed = timed(model.predict, X_test)
+        if reference is None:
+            reference = predictions
+        report(backend, fit, elapsed, 1.0, predictions, reference, y_test)
+
+    model, fit = timed(train_model, X_train, y_train, "ivf")
+    for probes in PROBES:
+        if probes > len(model.centroids):
+            break
+        model.probes = probes
+        (ids, _), elapsed = timed(model.kneighbors, X_test)
+        predictions = model.predict(X_test)
+        report(f"ivf {probes}/{len(model.centroids)}", fit, elapsed,
+               recall(ids, truth), predictions, reference, y_test)
+
+    workers = os.cpu_count()
+    if workers > 1:
+        model.probes, model.workers = PROBES[3], workers
+        predictions, elapsed = timed(model.predict, X_test)
+        report(f"ivf x{workers}", fit, elapsed, None, predictions, reference, y_test)
+
+
+def enlarge(evidence, labels, copies, seed=0):
+    """
+    Return `copies` copies of `evidence` and `labels`, all but the first
+    with gaussian noise of NOISE times the standard deviation of each
+    feature, to stand for a larger shopping log.
+    """
+    rng = numpy.random.default_rng(seed)
+    scale = NOISE * evidence.std(axis=0)
+    evidence = numpy.concatenate([evidence] + [
+        evidence + rng.normal(size=evidence.shape) * scale for _ in range(copies - 1)
+    ])
+    return evidence, numpy.tile(labels, copies)
+
+
+def timed(function, *args):
+    """
+    Call `function` with `args`, and return a tuple with its result and
+    the time it took in seconds.
+    """
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def recall(ids, truth):
+    """
+    Return the average share of the true nearest neighbors `truth` of a
+    query that are among the neighbors found, `ids`.
+    """
+    found = 0
+    for row, true_row in zip(ids, truth):
+        found += len(numpy.intersect1d(row, true_row))
+    return found / truth.size
+
+
+def report(backend, fit, elapsed, found, predictions, reference, labels):
+    """
+    Print one line of the results table.
+    """
+    sensitivity, specificity = evaluate(labels, predictions)
+    found = "-" if found is None else f"{found:.3f}"
+    print(f"{backend:<16}{fit:>8.2f}s{len(labels) / elapsed:>11.0f}{found:>8}"
+          f"{(predictions == reference).mean():>11.3f}"
+          f"{100 * sensitivity:>12.2f}%{100 * specificity:>12.2f}%")
+
+
+if __name__ == "__main__":
+    main()
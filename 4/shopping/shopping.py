@@ -1,17 +1,72 @@
-import csv
+import io
+import multiprocessing
+import numpy
+import pickle
 import sys
 
 from sklearn.model_selection import train_test_split
 from sklearn.neighbors import KNeighborsClassifier
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
 
 TEST_SIZE = 0.4
 
+# Neighbor search of train_model, and neighbors that vote on a prediction
+BACKENDS = ["auto", "brute", "kd_tree", "ball_tree", "ivf"]
+BACKEND = "auto"
+NEIGHBORS = 1000
+
+# Lists of the inverted file index searched for each query, queries
+# searched at a time, and rounds of k-means that build the lists
+PROBES = 8
+QUERY_BATCH = 256
+KMEANS_ITERATIONS = 10
+
+# Bytes of the CSV file parsed at a time
+CHUNK = 1 << 24
+
+# Columns of the evidence, and how their values are parsed
+COLUMNS = [
+    ("Administrative", "integer"),
+    ("Administrative_Duration", "float"),
+    ("Informational", "integer"),
+    ("Informational_Duration", "float"),
+    ("ProductRelated", "integer"),
+    ("ProductRelated_Duration", "float"),
+    ("BounceRates", "float"),
+    ("ExitRates", "float"),
+    ("PageValues", "float"),
+    ("SpecialDay", "float"),
+    ("Month", "month"),
+    ("OperatingSystems", "integer"),
+    ("Browser", "integer"),
+    ("Region", "integer"),
+    ("TrafficType", "integer"),
+    ("VisitorType", "visitor"),
+    ("Weekend", "boolean")
+]
+
+# Types of the values of each kind of column as read from the file
+TYPES = {
+    "integer": "i8",
+    "float": "f8",
+    "month": "S4",
+    "visitor": "S32",
+    "boolean": "S5",
+    "text": "S32"
+}
+
+# Months, numbered from 0, and the text values of other columns encoded as 1
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "June", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+TRUE = {"visitor": b"Returning_Visitor", "boolean": b"TRUE"}
+
 
 def main():
 
     # Check command-line arguments
-    if len(sys.argv) != 2:
-        sys.exit("Usage: python shopping.py data")
+    if len(sys.argv) not in [2, 3] or (len(sys.argv) == 3 and sys.argv[2] not in BACKENDS):
+        sys.exit(f"Usage: python shopping.py data [{'|'.join(BACKENDS)}]")
+    backend = sys.argv[2] if len(sys.argv) == 3 else BACKEND
 
     # Load data from spreadsheet and split into train and test sets
     evidence, labels = load_data(sys.argv[1])
@@ -20,7 +75,7 @@ def main():
     )
 
     # Train model and make predictions
-    model = train_model(X_train, y_train)
+    model = train_model(X_train, y_train, backend)
     predictions = model.predict(X_test)
     sensitivity, specificity = evaluate(y_test, predictions)
 
@@ -33,11 +88,11 @@ def main():
 
 def load_data(filename):
     """
-    Load shopping data from a CSV file `filename` and convert into a list of
-    evidence lists and a list of labels. Return a tuple (evidence, labels).
+    Load shopping data from a CSV file `filename` and convert into an array
+    of evidence and an array of labels. Return a tuple (evidence, labels).
 
-    evidence should be a list of lists, where each list contains the
-    following values, in order:
+    evidence is a 2-D array of floats with a row for each customer, with
+    the following values, in order:
         - Administrative, an integer
         - Administrative_Duration, a floating point number
         - Informational, an integer
@@ -56,65 +111,286 @@ def load_data(filename):
         - VisitorType, an integer 0 (not returning) or 1 (returning)
         - Weekend, an integer 0 (if false) or 1 (if true)
 
-    labels should be the corresponding list of labels, where each label
+    labels is the corresponding array of labels, where each label
     is 1 if Revenue is true, and 0 otherwise.
     """
-    # lists for evidence and labels
-    evidence = []
-    label = []
-
-    with open(filename, 'r') as file:
-        reader = csv.DictReader(file)
-
-        # each row is a different costumer
-        index = 0
-        for row in reader:
-            # get evidence values and store in list
-            evidence.append([])
-            evidence[index].append(int(row['Administrative']))
-            evidence[index].append(float(row['Administrative_Duration']))
-            evidence[index].append(int(row['Informational']))
-            evidence[index].append(float(row['Informational_Duration']))
-            evidence[index].append(int(row['ProductRelated']))
-            evidence[index].append(float(row['ProductRelated_Duration']))
-            evidence[index].append(float(row['BounceRates']))
-            evidence[index].append(float(row['ExitRates']))
-            evidence[index].append(float(row['PageValues']))
-            evidence[index].append(float(row['SpecialDay']))
-
-            months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'June', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-            evidence[index].append(int(months.index(row['Month'])))
-
-            evidence[index].append(int(row['OperatingSystems']))
-            evidence[index].append(int(row['Browser']))
-            evidence[index].append(int(row['Region']))
-            evidence[index].append(int(row['TrafficType']))
-            
-            visitor_type = 1 if row['VisitorType'] == 'Returning_Visitor' else 0
-            evidence[index].append(int(visitor_type))
-            
-            weekend = 1 if row['Weekend'] == 'TRUE' else 0
-            evidence[index].append(int(weekend))
-
-            # get revenue value and store in label
-            revenue = 1 if row['Revenue'] == 'TRUE' else 0
-            label.append(int(revenue)) 
-
-            # update costumer count
-            index += 1
-
-        return (evidence, label)
-
-def train_model(evidence, labels):
-    """
-    Given a list of evidence lists and a list of labels, return a
-    fitted k-nearest neighbor model (k=1) trained on the data.
-    """
-    model = KNeighborsClassifier(n_neighbors=1000)
+    chunks = list(load_chunks(filename))
+    evidence = numpy.concatenate([chunk[0] for chunk in chunks])
+    labels = numpy.concatenate([chunk[1] for chunk in chunks])
+    return (evidence, labels)
+
+
+def load_chunks(filename, size=CHUNK):
+    """
+    Load shopping data from a CSV file `filename`, about `size` bytes at
+    a time, so that files larger than memory can be streamed. Yield a
+    tuple (evidence, labels) of arrays for each chunk, as in load_data.
+
+    Each chunk is parsed in one pass by numpy into a record array with
+    a typed field for each column, then text columns are encoded
+    looking up only their distinct values.
+    """
+    with open(filename, "rb") as file:
+        header = file.readline().decode().strip().split(",")
+        kinds = dict(COLUMNS + [("Revenue", "boolean")])
+        types = [(name, TYPES[kinds.get(name, "text")]) for name in header]
+        rest = b""
+        while True:
+            data = file.read(size)
+            lines = rest + data
+            if data:
+                end = lines.rfind(b"\n") + 1
+                lines, rest = lines[:end], lines[end:]
+            if lines.strip():
+                records = numpy.loadtxt(
+                    io.BytesIO(lines), delimiter=",", dtype=types, ndmin=1
+                )
+                evidence = numpy.empty((len(records), len(COLUMNS)))
+                for i, (name, kind) in enumerate(COLUMNS):
+                    evidence[:, i] = encode_column(records[name], kind)
+                labels = encode_column(records["Revenue"], "boolean").astype(numpy.int8)
+                yield evidence, labels
+            if not data:
+                return
+
+
+def encode_column(values, kind):
+    """
+    Return the numbers for the `values` of a column of type `kind`:
+    numbers as they are, and the index of months or 0 or 1 for other
+    text values, looked up once for each distinct value.
+    """
+    if kind in ["integer", "float"]:
+        return values
+    distinct, inverse = numpy.unique(values, return_inverse=True)
+    if kind == "month":
+        months = [month.encode() for month in MONTHS]
+        unknown = set(distinct.tolist()) - set(months)
+        if unknown:
+            raise ValueError(f"Unknown months {sorted(unknown)}")
+        codes = [months.index(month) for month in distinct.tolist()]
+    else:
+        codes = [int(value == TRUE[kind]) for value in distinct.tolist()]
+    return numpy.array(codes, dtype=int)[inverse.reshape(-1)]
+
+
+def train_model(evidence, labels, backend=BACKEND, k=NEIGHBORS, workers=1):
+    """
+    Given an array of evidence and an array of labels, return a fitted
+    k-nearest neighbor model trained on the data, with standardized
+    features. `backend` is the neighbor search: "auto", "brute",
+    "kd_tree" or "ball_tree" for exact search by scikit-learn, or "ivf"
+    for the approximate IVFClassifier. Predictions are made by `workers`
+    processes (or threads, for scikit-learn).
+    """
+    if backend == "ivf":
+        model = IVFClassifier(k, workers=workers)
+    elif backend in ["auto", "brute", "kd_tree", "ball_tree"]:
+        model = make_pipeline(
+            StandardScaler(),
+            KNeighborsClassifier(n_neighbors=k, algorithm=backend, n_jobs=workers)
+        )
+    else:
+        raise ValueError(f"Unknown backend {backend!r}")
     model.fit(evidence, labels)
     return model
 
 
+class IVFClassifier():
+
+    def __init__(self, k=NEIGHBORS, lists=None, probes=PROBES, workers=1, seed=0):
+        """
+        Initialize a k-nearest neighbor classifier over an inverted file
+        index: training points are standardized and grouped into `lists`
+        clusters by k-means, and a query only looks at the points of the
+        `probes` clusters with the nearest centroids. More probes find
+        more of the true nearest neighbors, and take longer; probing
+        every list is an exact search. By default there are about as many
+        lists as the square root of the number of points, but few enough
+        that `probes` lists hold about 2k points. Queries are answered
+        QUERY_BATCH at a time, by `workers` processes.
+        """
+        self.k = k
+        self.lists = lists
+        self.probes = probes
+        self.workers = workers
+        self.seed = seed
+
+    def fit(self, evidence, labels):
+        """
+        Build the index of the points `evidence` with their `labels`.
+        """
+        evidence = numpy.asarray(evidence, dtype=numpy.float64)
+        self.mean = evidence.mean(axis=0)
+        self.scale = evidence.std(axis=0)
+        self.scale[self.scale == 0] = 1
+        points = self.standardize(evidence)
+
+        lists = self.lists or max(1, min(
+            int(len(points) ** 0.5), self.probes * len(points) // (2 * self.k)
+        ))
+        self.centroids = kmeans(points, lists, seed=self.seed)
+        assignment = nearest(points, self.centroids)
+
+        # keep the points of each list together, in the order of the lists
+        self.ids = numpy.argsort(assignment, kind="stable")
+        self.points = points[self.ids]
+        self.norms = (self.points ** 2).sum(axis=1)
+        self.labels = numpy.asarray(labels)[self.ids]
+        self.offsets = numpy.searchsorted(assignment[self.ids], numpy.arange(lists + 1))
+        return self
+
+    def standardize(self, evidence):
+        """
+        Return `evidence` with every feature scaled to mean 0 and
+        standard deviation 1 over the training points, as float32.
+        """
+        return ((numpy.asarray(evidence) - self.mean) / self.scale).astype(numpy.float32)
+
+    def predict(self, evidence):
+        """
+        Return an array with the label of the majority of the k nearest
+        training points found for each row of `evidence`.
+        """
+        _, labels = self.kneighbors(evidence)
+        return (labels.mean(axis=1) > 0.5).astype(self.labels.dtype)
+
+    def kneighbors(self, evidence):
+        """
+        Return a tuple (ids, labels) of arrays with the positions in the
+        training data of the k nearest training points found for each
+        row of `evidence`, nearest first, and their labels.
+        """
+        queries = self.standardize(evidence)
+        batches = [
+            queries[start:start + QUERY_BATCH]
+            for start in range(0, len(queries), QUERY_BATCH)
+        ]
+        if self.workers == 1:
+            results = [self.search(batch) for batch in batches]
+        else:
+            with multiprocessing.Pool(
+                self.workers, initializer=set_index, initargs=(self,)
+            ) as pool:
+                results = pool.map(search_batch, batches)
+        if not results:
+            return numpy.zeros((0, self.k), dtype=int), numpy.zeros((0, self.k), dtype=int)
+        positions = numpy.concatenate(results)
+        return self.ids[positions], self.labels[positions]
+
+    def search(self, queries):
+        """
+        Return an array with the positions, in the index, of the k
+        nearest points found for each of the standardized `queries`,
+        nearest first.
+        """
+        k = min(self.k, len(self.points))
+        probes = min(self.probes, len(self.centroids))
+        distances = squared_distances(queries, self.centroids)
+        probed = numpy.argpartition(distances, probes - 1, axis=1)[:, :probes]
+
+        # best distances and positions so far, merged with those of each
+        # list in turn for the queries that probe it
+        best = numpy.full((len(queries), k), numpy.inf, dtype=numpy.float32)
+        positions = numpy.zeros((len(queries), k), dtype=numpy.int64)
+        for cluster in numpy.unique(probed):
+            rows = numpy.flatnonzero((probed == cluster).any(axis=1))
+            start, end = self.offsets[cluster], self.offsets[cluster + 1]
+            if start == end:
+                continue
+            candidates = numpy.concatenate((
+                best[rows],
+                squared_distances(queries[rows], self.points[start:end], self.norms[start:end])
+            ), axis=1)
+            indices = numpy.concatenate((
+                positions[rows],
+                numpy.broadcast_to(numpy.arange(start, end), (len(rows), end - start))
+            ), axis=1)
+            keep = numpy.argpartition(candidates, k - 1, axis=1)[:, :k]
+            best[rows] = numpy.take_along_axis(candidates, keep, axis=1)
+            positions[rows] = numpy.take_along_axis(indices, keep, axis=1)
+
+        # if fewer than k points were probed, repeat the nearest one
+        order = numpy.argsort(best, axis=1)
+        positions = numpy.take_along_axis(positions, order, axis=1)
+        missing = numpy.isinf(numpy.take_along_axis(best, order, axis=1))
+        return numpy.where(missing, positions[:, :1], positions)
+
+
+def set_index(index):
+    """
+    Keep the index of an IVFClassifier worker process.
+    """
+    global ivf
+    ivf = index
+
+
+def search_batch(queries):
+    """
+    Answer one batch of queries of IVFClassifier.kneighbors in a worker
+    process.
+    """
+    return ivf.search(queries)
+
+
+def squared_distances(queries, points, norms=None):
+    """
+    Return the matrix of squared euclidean distances from every row of
+    `queries` to every row of `points`, whose squared norms may be given.
+    """
+    if norms is None:
+        norms = (points ** 2).sum(axis=1)
+    distances = (queries ** 2).sum(axis=1)[:, None] - 2 * queries @ points.T + norms
+    return numpy.maximum(distances, 0)
+
+
+def nearest(points, centroids):
+    """
+    Return the index of the nearest of `centroids` to each of `points`.
+    """
+    assignment = numpy.empty(len(points), dtype=numpy.int64)
+    for start in range(0, len(points), QUERY_BATCH):
+        batch = points[start:start + QUERY_BATCH]
+        assignment[start:start + QUERY_BATCH] = squared_distances(batch, centroids).argmin(axis=1)
+    return assignment
+
+
+def kmeans(points, clusters, iterations=KMEANS_ITERATIONS, seed=0):
+    """
+    Return the centroids of `clusters` clusters of `points`, starting
+    from random points and improved by `iterations` rounds of Lloyd's
+    algorithm. A centroid whose cluster empties stays where it was.
+    """
+    rng = numpy.random.default_rng(seed)
+    centroids = points[rng.choice(len(points), clusters, replace=False)]
+    for _ in range(iterations):
+        assignment = nearest(points, centroids)
+        counts = numpy.bincount(assignment, minlength=clusters)
+        sums = numpy.column_stack([
+            numpy.bincount(assignment, weights=feature, minlength=clusters)
+            for feature in points.T
+        ])
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+
+def save_model(model, path):
+    """
+    Write a model returned by train_model to the file at `path`.
+    """
+    with open(path, "wb") as f:
+        pickle.dump(model, f)
+
+
+def load_model(path):
+    """
+    Read a model written by save_model.
+    """
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
 def evaluate(labels, predictions):
     """
     Given a list of actual labels and a list of predicted labels,
@@ -130,17 +406,12 @@ def evaluate(labels, predictions):
     representing the "true negative rate": the proportion of
     actual negative labels that were accurately identified.
     """
-    # count correct predictions ocurrence
-    ones_prediction = 0
-    zeroes_predictions = 0
-    for label, prediction in zip(labels, predictions):
-        if label == 1:
-            ones_prediction += 1 if prediction == 1 else 0
-        if label == 0:
-            zeroes_predictions += 1 if prediction == 0 else 0
-
-    sensitivity = float(ones_prediction / labels.count(1))
-    specificity = float(zeroes_predictions / labels.count(0))
+    labels = numpy.asarray(labels)
+    predictions = numpy.asarray(predictions)
+
+    # share of correct predictions among positive and negative labels
+    sensitivity = float((predictions[labels == 1] == 1).mean())
+    specificity = float((predictions[labels == 0] == 0).mean())
 
     return (sensitivity, specificity)
 